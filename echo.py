@@ -1,19 +1,18 @@
-print("Importing. Warning messages from side_packages are normal.")
-
 import argparse
 import os
-import yaml
+import sys
 
-from model_management.whisper import whisper_download, whisper_model_address
-from model_management.huggingface import huggingface_download
-from echo.CaptionParser import CaptionParser
-from echo.CaptionWriter import CaptionWriter
+from contextlib import redirect_stdout
 
-model_settings = yaml.load(open("./conf/model_config.yaml", "r"), Loader=yaml.FullLoader)
+# Every mode imports only the modules it needs, torch, whisper, transformers and moviepy are slow to import.
 
 
 def attempt_download_model(model_name: str, force_download: bool = False, args: argparse.Namespace = None) -> dict:
+    from model_management.whisper import whisper_download, whisper_model_address
+    from echo.config import get_model_config
+
     assert model_name is not None, "Model name is required."
+    model_settings = get_model_config()
     os.makedirs(model_settings["default_model_path"], exist_ok=True)
 
     if model_name in whisper_model_address:
@@ -24,6 +23,8 @@ def attempt_download_model(model_name: str, force_download: bool = False, args:
             "model_type": "whisper"
         }
     else:
+        from model_management.huggingface import huggingface_download
+
         huggingface_download(model_name, args)
         model_info = {
             "model_name": model_name,
@@ -36,25 +37,162 @@ def attempt_download_model(model_name: str, force_download: bool = False, args:
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("-mode", type=str, choices=["parse", "write", "download"],
+    parser.add_argument("-mode", type=str,
+                        choices=["parse", "write", "export", "run", "live", "serve", "submit", "download", "verify",
+                                 "cache", "benchmark"],
                         default="parse", required=True)
-    parser.add_argument("-video_path", type=str)
+    parser.add_argument("-video_path", type=str,
+                        help="Video to process. In parse mode a directory or glob pattern transcribes every match.")
     parser.add_argument("-model_name", type=str)
     parser.add_argument("-filename", type=str)
     parser.add_argument("-token", type=str)
     parser.add_argument("-force_download", action="store_true")
     parser.add_argument("-language", type=str, default="Chinese")
+    parser.add_argument("-vad", action="store_true", help="Only transcribe the speech chunks detected by VAD.")
+    parser.add_argument("-batch_size", type=int, default=0,
+                        help="Decode this many 30 second windows together. 0 disables batched decoding of Whisper "
+                             "models and uses huggingface.batch_size for Hugging Face models.")
+    parser.add_argument("-workers", type=int, default=1,
+                        help="Worker processes used when parsing a directory or glob of videos.")
+    parser.add_argument("-shards", type=int, default=0,
+                        help="Split one video across every CUDA device, or across this many CPU processes "
+                             "without CUDA. 0 disables sharding.")
+    parser.add_argument("-no_cache", action="store_true", help="Do not read or write the transcription cache.")
+    parser.add_argument("-renderer", type=str, choices=["fast", "ffmpeg", "moviepy"], default="fast",
+                        help="Caption burn-in backend used in write mode.")
+    parser.add_argument("-source", type=str, default="-",
+                        help="Live mode input, a file, stream URL or - for stdin.")
+    parser.add_argument("-output", type=str, default="-", help="Live mode subtitle output, - for stdout.")
+    parser.add_argument("-subtitle_format", type=str, choices=["srt", "vtt"], default="srt")
+    parser.add_argument("-formats", type=str, default="srt,vtt,ass",
+                        help="Comma separated subtitle formats written in export mode.")
+    parser.add_argument("-latency", type=float, default=5.0,
+                        help="Longest utterance in seconds before live mode transcribes it anyway.")
+    parser.add_argument("-follow", action="store_true", help="Keep reading a live mode source file as it grows.")
+    parser.add_argument("-realtime", action="store_true", help="Replay a live mode source file at its native rate.")
+    parser.add_argument("-profile", type=str,
+                        help="Write the per stage timings and memory of parse or write mode to this JSON file.")
+    parser.add_argument("-models", type=str,
+                        help="Comma separated Whisper models to run in benchmark mode (default tiny,base,small) "
+                             "or to preload in serve mode.")
+    parser.add_argument("-backend", type=str, choices=["auto", "cpu", "int8"], default="auto",
+                        help="Whisper inference backend: auto uses CUDA when available, cpu runs fp32 on the CPU, "
+                             "int8 runs a dynamically quantized model on the CPU.")
+    parser.add_argument("-dtype", type=str, choices=["float32", "float16", "bfloat16"],
+                        help="Precision of Hugging Face models, defaults to huggingface.dtype in model_config.yaml.")
+    parser.add_argument("-threads", type=int, default=0, help="CPU threads used by torch, 0 keeps the default.")
+    parser.add_argument("-backends", type=str,
+                        help="Comma separated backends to compare in benchmark mode, defaults to -backend.")
+    parser.add_argument("-reference", type=str,
+                        help="Reference transcript for the word error rate in benchmark mode.")
+    parser.add_argument("-port", type=int, help="Port of the transcription server in serve and submit mode.")
+    parser.add_argument("-priority", type=int, default=0,
+                        help="Priority of a job submitted to the transcription server, lower runs first.")
+    parser.add_argument("-bench_duration", type=float, default=60.0,
+                        help="Length of the generated test media when benchmark mode has no -video_path.")
+    parser.add_argument("-cache_action", type=str, choices=["info", "clear"], default="info")
 
     args = parser.parse_args()
 
     if args.mode == "parse":
+        from echo.BatchParser import BatchParser
+        from echo.CaptionParser import CaptionParser
+        from echo.Profiler import Profiler
+
         model_info = attempt_download_model(args.model_name, args.force_download, args)
+        if BatchParser.is_batch(args.video_path):
+            batch_parser = BatchParser(args.video_path, args.workers, language=args.language, use_vad=args.vad,
+                                       batch_size=args.batch_size, use_cache=not args.no_cache,
+                                       backend=args.backend, threads=args.threads, dtype=args.dtype, **model_info)
+            batch_parser.parse_captions()
+            return
+
+        profiler = Profiler()
         caption_parser = CaptionParser(args.video_path, model_info["model_name"], model_info["model_path"],
-                                       model_info["model_type"], args.language)
-        caption_parser.parse_captions_with_whisper()
+                                       model_info["model_type"], args.language, args.vad,
+                                       args.batch_size, use_cache=not args.no_cache, profiler=profiler,
+                                       backend=args.backend, threads=args.threads, dtype=args.dtype)
+        if args.shards:
+            from echo.ShardedParser import ShardedParser
+
+            ShardedParser(caption_parser, args.shards).parse_captions()
+        else:
+            caption_parser.parse_captions()
+        if args.profile:
+            profiler.save(args.profile)
     elif args.mode == "write":
-        caption_writer = CaptionWriter(args.video_path)
+        from echo.CaptionWriter import CaptionWriter
+        from echo.Profiler import Profiler
+
+        profiler = Profiler()
+        caption_writer = CaptionWriter(args.video_path, args.renderer, profiler)
         caption_writer.write_captions(args.video_path)
+        if args.profile:
+            profiler.save(args.profile)
+    elif args.mode == "export":
+        from echo.SubtitleExporter import SubtitleExporter
+
+        subtitle_exporter = SubtitleExporter(args.video_path, args.formats.split(","))
+        subtitle_exporter.export()
+    elif args.mode == "run":
+        from echo.StreamingPipeline import StreamingPipeline
+
+        model_info = attempt_download_model(args.model_name, args.force_download, args)
+        pipeline = StreamingPipeline(args.video_path, model_info["model_name"], model_info["model_path"],
+                                     model_info["model_type"], args.language, args.vad,
+                                     use_cache=not args.no_cache, backend=args.backend, threads=args.threads)
+        pipeline.run()
+    elif args.mode == "live":
+        from echo.LiveCaptioner import LiveCaptioner
+
+        # Live mode can write subtitles to stdout, the download messages go to stderr.
+        with redirect_stdout(sys.stderr):
+            model_info = attempt_download_model(args.model_name, args.force_download, args)
+        assert model_info["model_type"] == "whisper", "Live mode only supports Whisper models."
+        live_captioner = LiveCaptioner(args.source, model_info["model_name"], args.language, args.output,
+                                       args.subtitle_format, args.latency, args.follow, args.realtime,
+                                       args.backend, args.threads)
+        live_captioner.run()
+    elif args.mode == "benchmark":
+        from echo.Benchmark import Benchmark
+
+        benchmark = Benchmark((args.models or "tiny,base,small").split(","), args.video_path, args.bench_duration,
+                              args.language, args.renderer, args.vad, args.batch_size,
+                              (args.backends or args.backend).split(","), args.threads, args.reference)
+        benchmark.run()
+    elif args.mode == "serve":
+        from echo.TranscriptionServer import TranscriptionServer
+
+        server = TranscriptionServer(args.models.split(",") if args.models else [], port=args.port,
+                                     workers=args.workers)
+        server.serve_forever()
+    elif args.mode == "submit":
+        from echo.TranscriptionClient import TranscriptionClient
+
+        client = TranscriptionClient(port=args.port)
+        job = client.submit(os.path.abspath(args.video_path), args.model_name, args.language, args.priority,
+                            args.vad, args.batch_size)
+        print(f"Submitted job {job['id']}")
+        for segment in client.iter_segments(job["id"]):
+            print(f"{round(segment['start'], 2)}-{round(segment['end'], 2)}: {segment['text']}")
+        # The captions are written by the server, the job does not need to be kept.
+        client.delete(job["id"])
+    elif args.mode == "download":
+        attempt_download_model(args.model_name, args.force_download, args)
+    elif args.mode == "verify":
+        from model_management.manifest import verify_models
+
+        failed = verify_models()
+        print(f"Verification complete, {len(failed)} models failed")
+    elif args.mode == "cache":
+        from echo.TranscriptionCache import TranscriptionCache
+
+        cache = TranscriptionCache()
+        if args.cache_action == "clear":
+            cache.clear()
+            print(f"Cleared transcription cache {cache.cache_path}")
+        else:
+            print(cache.info())
 
 
 if __name__ == "__main__":
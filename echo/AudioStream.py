@@ -0,0 +1,83 @@
+import threading
+import subprocess
+import numpy as np
+
+from collections import deque
+
+SAMPLE_RATE = 16000
+
+
+class AudioStream:
+    def __init__(self, source: str, sample_rate: int = SAMPLE_RATE, block_seconds: float = 30.0,
+                 follow: bool = False, realtime: bool = False):
+        """
+        Decode the audio track of `source` with ffmpeg straight to mono float32 samples at `sample_rate`.
+        The samples come through a pipe, no intermediate audio file is written.
+        `source` may be "-" to read from stdin, `follow` keeps reading a file that is still being written,
+        and `realtime` reads the input at its native rate to replay a file as if it were live.
+        """
+        self.source = source
+        self.sample_rate = sample_rate
+        self.block_seconds = block_seconds
+        self.follow = follow
+        self.realtime = realtime
+
+    def get_command(self) -> list:
+        input_args = ["-nostdin"] if self.source != "-" else []
+        if self.follow:
+            input_args += ["-follow", "1"]
+        if self.realtime:
+            input_args += ["-re"]
+
+        return [
+            "ffmpeg", "-loglevel", "error", *input_args,
+            "-i", self.source,
+            "-vn", "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(self.sample_rate),
+            "-"
+        ]
+
+    @staticmethod
+    def to_float32(data: bytes) -> np.ndarray:
+        return np.frombuffer(data, np.int16).astype(np.float32) / 32768.0
+
+    @staticmethod
+    def drain(stream, tail: deque) -> None:
+        # ffmpeg blocks once its stderr pipe is full, long live sessions can log many decode errors.
+        for line in stream:
+            tail.append(line.decode(errors="replace"))
+        stream.close()
+
+    def __iter__(self):
+        """
+        Yield blocks of `block_seconds` seconds of samples while ffmpeg is still decoding.
+        """
+        process = subprocess.Popen(self.get_command(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        error_tail = deque(maxlen=20)
+        error_thread = threading.Thread(target=self.drain, args=(process.stderr, error_tail), daemon=True)
+        error_thread.start()
+        block_bytes = int(self.block_seconds * self.sample_rate) * 2
+        try:
+            while True:
+                data = process.stdout.read(block_bytes)
+                if not data:
+                    break
+                yield self.to_float32(data)
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            error_thread.join()
+
+        if process.returncode != 0:
+            raise RuntimeError(f"Failed to decode audio from {self.source}: {''.join(error_tail)}")
+
+    def read(self) -> np.ndarray:
+        """
+        Decode the whole audio track into memory.
+        """
+        process = subprocess.run(self.get_command(), capture_output=True)
+        if process.returncode != 0:
+            raise RuntimeError(f"Failed to decode audio from {self.source}: "
+                               f"{process.stderr.decode(errors='replace')}")
+        return self.to_float32(process.stdout)
@@ -0,0 +1,94 @@
+import os
+import glob
+import time
+import traceback
+
+from multiprocessing import get_context
+
+from torch import set_num_threads
+from silero_vad import load_silero_vad
+
+from echo.CaptionParser import CaptionParser
+
+# Models loaded once by each worker process and reused for every video it is given.
+_worker_state = {}
+
+
+def _init_worker(parser_kwargs: dict, num_threads: int) -> None:
+    # An initializer that raises makes the pool respawn the worker forever, the error is reported per video instead.
+    _worker_state["error"] = None
+    try:
+        set_num_threads(parser_kwargs.get("threads") or num_threads)
+
+        _worker_state["parser_kwargs"] = parser_kwargs
+        _worker_state["speech_recognition_model"] = load_silero_vad(onnx=False)
+        _worker_state["transcribe_model"] = None
+        if parser_kwargs["model_type"] == "whisper":
+            _worker_state["transcribe_model"] = CaptionParser.load_whisper_model(parser_kwargs["model_name"],
+                                                                                 parser_kwargs.get("backend", "auto"))
+        elif parser_kwargs["model_type"] == "huggingface":
+            _worker_state["transcribe_model"] = CaptionParser.load_huggingface_model(parser_kwargs["model_path"],
+                                                                                     parser_kwargs.get("dtype"))
+    except Exception:
+        _worker_state["error"] = f"Worker failed to load its models:\n{traceback.format_exc()}"
+
+
+def _parse_video(video_path: str) -> tuple:
+    start_time = time.perf_counter()
+    if _worker_state["error"]:
+        return video_path, 0, 0.0, _worker_state["error"]
+    try:
+        caption_parser = CaptionParser(
+            video_path,
+            transcribe_model=_worker_state["transcribe_model"],
+            speech_recognition_model=_worker_state["speech_recognition_model"],
+            **_worker_state["parser_kwargs"]
+        )
+        sentences = caption_parser.parse_captions()
+        return video_path, len(sentences), time.perf_counter() - start_time, None
+    except Exception:
+        return video_path, 0, time.perf_counter() - start_time, traceback.format_exc()
+
+
+class BatchParser:
+    def __init__(self, video_pattern: str, workers: int, **parser_kwargs):
+        """
+        Transcribe every video matched by `video_pattern` with a pool of `workers` processes.
+        `video_pattern` is a directory (all .mp4 files inside it) or a glob pattern,
+        `parser_kwargs` are passed to every CaptionParser.
+        """
+        if os.path.isdir(video_pattern):
+            video_pattern = os.path.join(glob.escape(video_pattern), "*.mp4")
+
+        self.video_paths = sorted(glob.glob(video_pattern))
+        self.workers = max(1, min(workers, len(self.video_paths)))
+        self.parser_kwargs = parser_kwargs
+
+    @staticmethod
+    def is_batch(video_path: str) -> bool:
+        # An existing file is never a pattern, even with glob characters in its name like "Lecture [part1].mp4".
+        if os.path.isfile(video_path):
+            return False
+        return os.path.isdir(video_path) or glob.has_magic(video_path)
+
+    def parse_captions(self) -> list:
+        assert self.video_paths, "No videos matched the given video path."
+
+        num_threads = max(1, (os.cpu_count() or 1) // self.workers)
+        print(f"Transcribing {len(self.video_paths)} videos with {self.workers} workers")
+
+        failures = []
+        # Spawn instead of fork, forked workers can not initialise CUDA.
+        with get_context("spawn").Pool(self.workers, initializer=_init_worker,
+                                       initargs=(self.parser_kwargs, num_threads)) as pool:
+            for count, (video_path, segment_count, elapsed, error) in enumerate(
+                    pool.imap_unordered(_parse_video, self.video_paths), start=1):
+                if error is None:
+                    print(f"[{count}/{len(self.video_paths)}] {video_path}: "
+                          f"{segment_count} segments in {elapsed:.1f}s")
+                else:
+                    print(f"[{count}/{len(self.video_paths)}] {video_path} failed after {elapsed:.1f}s:\n{error}")
+                    failures.append(video_path)
+
+        print(f"Batch complete, {len(self.video_paths) - len(failures)} succeeded, {len(failures)} failed")
+        return failures
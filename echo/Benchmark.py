@@ -0,0 +1,122 @@
+import os
+import re
+import json
+import time
+import subprocess
+
+from model_management.whisper import whisper_download
+from echo.CaptionParser import CaptionParser
+from echo.CaptionWriter import CaptionWriter
+from echo.Profiler import Profiler
+from echo.config import get_model_config
+
+
+class Benchmark:
+    def __init__(self, model_names: list, media_path: str = None, duration: float = 60.0, language: str = "English",
+                 renderer: str = "fast", use_vad: bool = False, batch_size: int = 0, backends: list = None,
+                 threads: int = 0, reference_path: str = None):
+        """
+        Profile the parse pipeline with each Whisper model in `model_names` on each of `backends`,
+        and the write pipeline once, on `media_path` or on generated test media of `duration` seconds.
+        The transcription cache is bypassed so every run does the full work.
+        Word error rates are measured against the text in `reference_path`,
+        or against the first backend's transcript when there is no reference.
+        """
+        self.model_names = model_names
+        self.media_path = media_path
+        self.duration = duration
+        self.language = language
+        self.renderer = renderer
+        self.use_vad = use_vad
+        self.batch_size = batch_size
+        self.backends = backends or ["auto"]
+        self.threads = threads
+        self.reference_path = reference_path
+
+    def make_synthetic_media(self) -> str:
+        """
+        Generate a test pattern video with a sine tone. It has no speech, so it measures the pipeline overhead;
+        pass real recordings to measure transcription.
+        """
+        media_path = os.path.join("./output_bench", f"synthetic_{int(self.duration)}s.mp4")
+        if not os.path.exists(media_path):
+            subprocess.run(
+                ["ffmpeg", "-y", "-nostdin", "-loglevel", "error",
+                 "-f", "lavfi", "-i", "testsrc2=size=1280x720:rate=25",
+                 "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=44100",
+                 "-t", str(self.duration), "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+                 "-c:a", "aac", media_path],
+                check=True
+            )
+        return media_path
+
+    @staticmethod
+    def tokenize(text: str) -> list:
+        # CJK characters count as words, they are not separated by spaces. Punctuation is ignored.
+        return re.findall(r"[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]|[^\W\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]+",
+                          text.lower())
+
+    @staticmethod
+    def word_error_rate(reference: str, hypothesis: str) -> float:
+        reference, hypothesis = Benchmark.tokenize(reference), Benchmark.tokenize(hypothesis)
+        if not reference:
+            return float(len(hypothesis) > 0)
+
+        # Levenshtein distance over words, one row at a time.
+        previous = list(range(len(hypothesis) + 1))
+        for i, reference_word in enumerate(reference, start=1):
+            current = [i] + [0] * len(hypothesis)
+            for j, hypothesis_word in enumerate(hypothesis, start=1):
+                current[j] = min(previous[j] + 1, current[j - 1] + 1,
+                                 previous[j - 1] + (reference_word != hypothesis_word))
+            previous = current
+        return previous[-1] / len(reference)
+
+    def run(self) -> dict:
+        os.makedirs("./output_bench", exist_ok=True)
+        media_path = self.media_path or self.make_synthetic_media()
+
+        reference = None
+        if self.reference_path:
+            with open(self.reference_path, "r", encoding="utf-8") as f:
+                reference = f.read()
+
+        results = {"media": media_path, "parse": {}, "write": {}}
+        for model_name in self.model_names:
+            whisper_download(model_name)
+            model_reference = reference
+            for backend in self.backends:
+                profiler = Profiler()
+                caption_parser = CaptionParser(
+                    media_path, model_name,
+                    os.path.join(get_model_config()["default_model_path"], "whisper", model_name + ".pt"),
+                    "whisper", self.language, self.use_vad, self.batch_size, use_cache=False, profiler=profiler,
+                    backend=backend, threads=self.threads
+                )
+                transcript = " ".join(caption_parser.parse_captions().values())
+
+                key = f"{model_name}/{backend}"
+                results["parse"][key] = profiler.report()
+                if model_reference is None:
+                    model_reference = transcript
+                else:
+                    word_error_rate = self.word_error_rate(model_reference, transcript)
+                    results["parse"][key]["word_error_rate"] = round(word_error_rate, 4)
+                print(f"{key}: real time factor {results['parse'][key]['real_time_factor']}, "
+                      f"word error rate {results['parse'][key].get('word_error_rate')}")
+
+        # The write pipeline does not depend on the model, it renders the last model's captions.
+        profiler = Profiler()
+        caption_writer = CaptionWriter(media_path, self.renderer, profiler)
+        caption_writer.write_captions(media_path)
+        results["write"][self.renderer] = profiler.report()
+        print(f"{self.renderer} renderer: real time factor {results['write'][self.renderer]['real_time_factor']}")
+
+        results["environment"] = Profiler.get_environment()
+
+        output_path = os.path.join("./output_bench", f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json")
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+        print(f"Benchmark results written to {output_path}")
+
+        return results
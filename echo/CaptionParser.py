@@ -1,44 +1,100 @@
 import os
-import yaml
+import torch
 import warnings
 
-from silero_vad import load_silero_vad, read_audio, get_speech_timestamps
 from torch.cuda import is_available as cuda_is_available
-from whisper import load_model
-from transformers import pipeline
-from moviepy.video.io.VideoFileClip import VideoFileClip
 
-model_config = yaml.load(
-    open("./conf/model_config.yaml"
-         if not __name__ == "__main__" else
-         "../conf/model_config.yaml", "r"),
-    Loader=yaml.FullLoader
-)
+from echo.AudioStream import AudioStream, SAMPLE_RATE
+from echo.CaptionSegmenter import CaptionSegmenter
+from echo.TranscriptionCache import TranscriptionCache
+from echo.TranscriptStore import TranscriptWriter, get_transcript_path
+from echo.Profiler import Profiler
+from echo.config import get_model_config, get_caption_config
+
+# The temperature fallback and punctuation handling of whisper.transcribe, applied to batched decoding.
+TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+PREPEND_PUNCTUATIONS = "\"'“¿([{-"
+APPEND_PUNCTUATIONS = "\"'.。,，!！?？:：”)]}、"
 
 
 class CaptionParser:
-    def __init__(self, video_path: str, model_name: str, model_path: str, model_type: str, language: str):
+    def __init__(self, video_path: str, model_name: str, model_path: str, model_type: str, language: str,
+                 use_vad: bool = False, batch_size: int = 0, transcribe_model=None, speech_recognition_model=None,
+                 use_cache: bool = True, profiler: Profiler = None, backend: str = "auto", threads: int = 0,
+                 dtype: str = None, extract_audio: bool = True):
+        """
+        `extract_audio` decodes the whole audio track and runs VAD over it up front,
+        callers that stream the audio themselves turn it off and pass the chunks to transcribe_chunk.
+        """
+        # The speech recognition backends are heavy, they are imported where they are first used.
+        from silero_vad import load_silero_vad, get_speech_timestamps
+
         self.video_path = video_path
         self.model_name = model_name
         self.model_path = model_path
         self.model_type = model_type
         self.language = language
+        self.use_vad = use_vad
+        self.batch_size = batch_size
+        self.backend = backend
+        self.threads = threads
+        self.dtype = dtype
+        self.cache = TranscriptionCache() if use_cache else None
+        self.profiler = profiler or Profiler()
 
-        self.transcribe_model = None
-        self.speech_recognition_model = load_silero_vad(onnx=False)
-        self.audio_path = self.get_audio()
+        # Preloaded models can be passed in to keep them resident across several videos.
+        self.transcribe_model = transcribe_model
+        self.speech_recognition_model = speech_recognition_model
+        if self.speech_recognition_model is None:
+            with self.profiler.stage("vad_model_load"):
+                self.speech_recognition_model = load_silero_vad(onnx=False)
 
-        speech_timestamp = get_speech_timestamps(
-            read_audio(self.audio_path),
-            self.speech_recognition_model,
-            return_seconds=True
-        )
+        self.audio = None
+        self.speech_segments = []
+        if not extract_audio:
+            return
+
+        # Decoded once in memory, shared by the VAD pass and the transcription pass.
+        with self.profiler.stage("audio_extraction"):
+            self.audio = self.get_audio()
+        self.profiler.media_duration = len(self.audio) / SAMPLE_RATE
+
+        with self.profiler.stage("vad"):
+            speech_timestamp = get_speech_timestamps(
+                self.audio,
+                self.speech_recognition_model,
+                sampling_rate=SAMPLE_RATE,
+                return_seconds=True
+            )
 
-        self.speech_segments = self.get_speech_segments(speech_timestamp)
+            self.speech_segments = self.get_speech_segments(speech_timestamp)
 
     def get_speech_segments(self, speech_timestamp: list) -> list:
+        """
+        Merge the Silero VAD timestamps into speech chunks of at most `max_chunk_length` seconds.
+        Neighbouring timestamps are merged when the silence between them is shorter than `max_merge_gap`,
+        speech longer than `max_chunk_length` is cut into several chunks.
+        """
+        max_chunk_length = get_model_config()["vad"]["max_chunk_length"]
+        max_merge_gap = get_model_config()["vad"]["max_merge_gap"]
+
         speech_segments = []
-        # TODO
+        for timestamp in speech_timestamp:
+            start, end = timestamp["start"], timestamp["end"]
+            while end - start > max_chunk_length:
+                speech_segments.append((start, start + max_chunk_length))
+                start += max_chunk_length
+
+            if speech_segments and start - speech_segments[-1][1] <= max_merge_gap \
+                    and end - speech_segments[-1][0] <= max_chunk_length:
+                speech_segments[-1] = (speech_segments[-1][0], end)
+            else:
+                speech_segments.append((start, end))
+
+        return speech_segments
 
     def write_captions(self, sentenses: dict) -> None:
         os.makedirs("./output_txt", exist_ok=True)
@@ -48,78 +104,402 @@ class CaptionParser:
             for k, v in sentenses.items():
                 f.write(f"{k[0]}-{k[1]}: {v}\n")
 
-    def get_audio(self) -> str:
+    def write_transcript(self, segments: list) -> None:
+        """
+        Write the segments with their word timestamps, confidences and captions to ./output_transcript.
+        """
+        segments = sorted(segments, key=lambda segment: segment["start"])
+        caption_fields = CaptionSegmenter(get_caption_config()).get_caption_fields(segments)
+        with TranscriptWriter(get_transcript_path(self.video_path), overwrite=True) as transcript_writer:
+            for segment, fields in zip(segments, caption_fields):
+                transcript_writer.append(segment, **(fields or {}))
+
+    def get_audio(self) -> torch.Tensor:
         assert os.path.exists(self.video_path), "Video path does not exist."
 
-        _audio_path = self.video_path.replace(".mp4", ".wav")
-        if not os.path.exists(_audio_path):
-            video = VideoFileClip(self.video_path)
-            video.audio.write_audiofile(_audio_path)
-        return _audio_path
-
-    def do_whisper_transcribe(self) -> dict:
-        return self.transcribe_model.transcribe(
-            self.audio_path,
-            language=self.language,
-            word_timestamps=True
-        )
+        return torch.from_numpy(AudioStream(self.video_path, SAMPLE_RATE).read())
 
-    def parse_captions_with_whisper(self) -> dict:
-        self.transcribe_model = load_model(os.path.join(model_config["default_model_path"], "whisper", self.model_name + ".pt"))
+    def get_cache_key(self, audio: torch.Tensor, decoder: str, **options) -> str:
+        return TranscriptionCache.make_key(audio.numpy(), model=self.model_name, language=self.language,
+                                           decoder=decoder, word_timestamps=True, backend=self.backend,
+                                           dtype=self.dtype, **options)
 
-        if cuda_is_available():
-            self.transcribe_model = self.transcribe_model.cuda()
-        else:
-            self.transcribe_model = self.transcribe_model.cpu()
-            warnings.warn("CUDA is not available, using CPU. Highly recommend using a GPU for faster inference.")
+    def get_window_audio(self, window: tuple) -> torch.Tensor:
+        return self.audio[int(window[0] * SAMPLE_RATE):int(window[1] * SAMPLE_RATE)]
 
-        print(f"Transcribing {self.video_path} with {self.model_name} model")
-        output = self.do_whisper_transcribe()
-        print(f"Transcription complete with {len(output['segments'])} segments")
+    def load_cached_windows(self, windows: list, decoder: str, **options) -> tuple:
+        """
+        Look the (start, end) windows up in the cache.
+        Returns the segments of the cached windows, the cache keys of every window and the windows left to transcribe.
+        """
+        window_segments = {}
+        keys = {}
+        if self.cache:
+            for window in windows:
+                keys[window] = self.get_cache_key(self.get_window_audio(window), decoder, **options)
+                cached = self.cache.get(keys[window])
+                if cached is not None:
+                    window_segments[window] = cached
+        return window_segments, keys, [window for window in windows if window not in window_segments]
 
-        sentences = {}
-        for segment in output['segments']:
-            sentences[(round(segment['start'], 2), round(segment['end'], 2))] = segment['text']
+    def cache_window(self, keys: dict, window: tuple, segments: list) -> None:
+        if self.cache:
+            self.cache.put(keys[window], segments)
+
+    def save_captions(self, segments: list) -> dict:
+        """
+        Write the sentences of the segments to ./output_txt and the segments to ./output_transcript.
+        """
+        sentences = self.to_sentences(segments)
 
         self.write_captions(sentences)
+        self.write_transcript(segments)
         print(f"Captions written to ./output_txt/{self.video_path.split('/')[-1].replace('.mp4', '.txt')}")
 
         return sentences
 
-    def parse_captions_with_huggingface(self) -> dict:
+    def do_whisper_transcribe(self) -> list:
+        key = self.get_cache_key(self.audio, "transcribe") if self.cache else None
+        segments = self.cache.get(key) if self.cache else None
+        if segments is None:
+            segments = self.transcribe_model.transcribe(
+                self.audio,
+                language=self.language,
+                word_timestamps=True
+            )["segments"]
+            if self.cache:
+                self.cache.put(key, segments)
+        else:
+            print("Transcription loaded from cache")
+
+        return segments
+
+    def iter_whisper_chunks(self, windows: list):
+        """
+        Transcribe the given (start, end) windows one by one, yielding (start, end, segments) as each one finishes.
+        Segment timestamps are mapped from the window back to the whole audio.
+        Windows are cached on their own, so a re-cut video only transcribes the windows that changed.
+        """
+        for start, end in windows:
+            yield start, end, self.transcribe_chunk(self.get_window_audio((start, end)), start, end)
+
+    def transcribe_chunk(self, chunk: torch.Tensor, start: float, end: float) -> list:
+        """
+        Transcribe the audio of the window (start, end) and map its segments back to the whole audio.
+        """
+        key = self.get_cache_key(chunk, "chunk") if self.cache else None
+        chunk_segments = self.cache.get(key) if self.cache else None
+        if chunk_segments is None:
+            chunk_segments = self.transcribe_model.transcribe(
+                chunk.numpy(),
+                language=self.language,
+                word_timestamps=True,
+                condition_on_previous_text=False
+            )["segments"]
+            if self.cache:
+                self.cache.put(key, chunk_segments)
+
+        return [self.offset_segment(segment, start, end) for segment in chunk_segments]
+
+    def do_whisper_transcribe_chunks(self) -> list:
+        """
+        Transcribe only the VAD speech chunks.
+        """
+        segments = []
+        for _, _, chunk_segments in self.iter_whisper_chunks(self.speech_segments):
+            segments.extend(chunk_segments)
+
+        return segments
+
+    def get_windows(self) -> list:
+        return self.speech_segments if self.use_vad else self.get_fixed_windows()
+
+    def get_fixed_windows(self) -> list:
+        from whisper.audio import CHUNK_LENGTH
+
+        duration = len(self.audio) / SAMPLE_RATE
+        return [(start, min(start + CHUNK_LENGTH, duration)) for start in range(0, int(duration) + 1, CHUNK_LENGTH)
+                if start < duration]
+
+    def get_language_code(self) -> str:
+        from whisper.tokenizer import LANGUAGES, TO_LANGUAGE_CODE
+
+        language = self.language.lower()
+        return language if language in LANGUAGES else TO_LANGUAGE_CODE[language]
+
+    def do_whisper_transcribe_batched(self) -> list:
+        """
+        Stack the log-mel spectrograms of up to `batch_size` 30 second windows and decode them together.
+        The windows are the VAD speech chunks when VAD is enabled, otherwise fixed 30 second windows.
+        Windows found in the cache are not decoded again.
+        Like transcribe, windows whose text is too repetitive or too unlikely are decoded again at higher
+        temperatures, and the words of every window are aligned for their timestamps.
+        """
+        from whisper import DecodingOptions, log_mel_spectrogram, pad_or_trim
+        from whisper.tokenizer import get_tokenizer
+
+        model = self.transcribe_model
+        windows = self.get_windows()
+        language = self.get_language_code()
+        tokenizer = get_tokenizer(model.is_multilingual, num_languages=model.num_languages,
+                                  language=language, task="transcribe")
+        options = DecodingOptions(task="transcribe", language=language, fp16=model.device.type == "cuda")
+
+        window_segments, keys, pending = self.load_cached_windows(windows, "batched", temperatures=TEMPERATURES)
+        if window_segments:
+            print(f"{len(window_segments)}/{len(windows)} windows loaded from cache")
+
+        for i in range(0, len(pending), self.batch_size):
+            batch = pending[i:i + self.batch_size]
+            mel = torch.stack([
+                log_mel_spectrogram(pad_or_trim(self.get_window_audio(window)), model.dims.n_mels) for window in batch
+            ]).to(model.device)
+
+            for j, ((start, end), result) in enumerate(zip(batch, self.decode_with_fallback(mel, options))):
+                if result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob < LOGPROB_THRESHOLD:
+                    window_segments[(start, end)] = []
+                else:
+                    window_segments[(start, end)] = self.split_timestamp_tokens(result, tokenizer, end - start)
+                    self.add_word_timestamps(window_segments[(start, end)], tokenizer, mel[j], end - start)
+                self.cache_window(keys, (start, end), window_segments[(start, end)])
+            print(f"Decoded {min(i + self.batch_size, len(pending))}/{len(pending)} windows")
+
+        segments = []
+        for start, end in windows:
+            segments.extend(self.offset_segment(segment, start, end) for segment in window_segments[(start, end)])
+
+        return segments
+
+    @staticmethod
+    def needs_fallback(result) -> bool:
+        """
+        Whether transcribe would reject a decoded window: too repetitive or too unlikely, unless it is silence.
+        """
+        if result.no_speech_prob > NO_SPEECH_THRESHOLD:
+            return False
+        return result.compression_ratio > COMPRESSION_RATIO_THRESHOLD or result.avg_logprob < LOGPROB_THRESHOLD
+
+    def decode_with_fallback(self, mel: torch.Tensor, options) -> list:
+        """
+        Decode a batch of windows, then decode the rejected ones again together at each next temperature.
+        """
+        from dataclasses import replace
+        from whisper import decode
+
+        results = decode(self.transcribe_model, mel, replace(options, temperature=TEMPERATURES[0]))
+        for temperature in TEMPERATURES[1:]:
+            retry = [i for i, result in enumerate(results) if self.needs_fallback(result)]
+            if not retry:
+                break
+            retried = decode(self.transcribe_model, mel[retry], replace(options, temperature=temperature))
+            for i, result in zip(retry, retried):
+                results[i] = result
+        return results
+
+    def add_word_timestamps(self, segments: list, tokenizer, mel: torch.Tensor, duration: float) -> None:
+        """
+        Align the tokens of a decoded window to its log-mel spectrogram, adding the words of its segments.
+        """
+        from whisper.audio import HOP_LENGTH
+        from whisper.timing import add_word_timestamps
+
+        model = self.transcribe_model
+        add_word_timestamps(
+            segments=segments,
+            model=model,
+            tokenizer=tokenizer,
+            mel=mel.to(torch.float16 if model.device.type == "cuda" else torch.float32),
+            num_frames=int(duration * SAMPLE_RATE / HOP_LENGTH),
+            prepend_punctuations=PREPEND_PUNCTUATIONS,
+            append_punctuations=APPEND_PUNCTUATIONS,
+            last_speech_timestamp=0.0,
+        )
+        for segment in segments:
+            del segment["tokens"], segment["seek"]
+
+    @staticmethod
+    def split_timestamp_tokens(result, tokenizer, duration: float) -> list:
+        """
+        Split a decoded window into segments on its timestamp tokens, e.g. <|0.00|> text <|2.40|><|2.40|> text ...
+        """
+        from whisper.audio import TOKENS_PER_SECOND
+
+        segments = []
+        text_tokens = []
+        segment_start = 0.0
+        for token in result.tokens:
+            if token < tokenizer.timestamp_begin:
+                text_tokens.append(token)
+                continue
+
+            time = (token - tokenizer.timestamp_begin) / TOKENS_PER_SECOND
+            if text_tokens:
+                segments.append({"start": segment_start, "end": time, "text": tokenizer.decode(text_tokens),
+                                 "tokens": text_tokens, "seek": 0,
+                                 "avg_logprob": result.avg_logprob, "no_speech_prob": result.no_speech_prob})
+                text_tokens = []
+            segment_start = time
+
+        if text_tokens:
+            segments.append({"start": segment_start, "end": duration, "text": tokenizer.decode(text_tokens),
+                             "tokens": text_tokens, "seek": 0,
+                             "avg_logprob": result.avg_logprob, "no_speech_prob": result.no_speech_prob})
+
+        return segments
+
+    @staticmethod
+    def offset_segment(segment: dict, offset: float, limit: float) -> dict:
+        segment = dict(segment)
+        segment["start"] = min(segment["start"] + offset, limit)
+        segment["end"] = min(segment["end"] + offset, limit)
+        if segment.get("words"):
+            segment["words"] = [
+                dict(word, start=min(word["start"] + offset, limit), end=min(word["end"] + offset, limit))
+                for word in segment["words"]
+            ]
+        return segment
+
+    @staticmethod
+    def to_sentences(segments: list) -> dict:
+        sentences = {}
+        for segment in segments:
+            sentences[(round(segment['start'], 2), round(segment['end'], 2))] = segment['text']
+        return sentences
+
+    @staticmethod
+    def quantize_whisper_model(transcribe_model):
+        """
+        Dynamic int8 quantization of the Whisper linear layers for CPU inference.
+        """
+        from whisper.model import Linear
+
+        for module in transcribe_model.modules():
+            if type(module) is Linear:
+                # Whisper's Linear only casts its weights to the input dtype, quantize_dynamic only swaps nn.Linear.
+                module.__class__ = torch.nn.Linear
+
+        return torch.ao.quantization.quantize_dynamic(transcribe_model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    @staticmethod
+    def load_whisper_model(model_name: str, backend: str = "auto", threads: int = 0, device: str = "cuda"):
+        """
+        Load a downloaded Whisper model. The "auto" backend uses CUDA `device` when available and fp32 on the CPU
+        otherwise, "cpu" always runs fp32 on the CPU and "int8" runs a dynamically quantized model on the CPU.
+        `threads` sets the number of CPU threads torch uses, 0 keeps torch's default.
+        """
+        from whisper import load_model
+
+        if threads > 0:
+            torch.set_num_threads(threads)
+
+        transcribe_model = load_model(
+            os.path.join(get_model_config()["default_model_path"], "whisper", model_name + ".pt"), device="cpu"
+        )
+
+        if backend == "int8":
+            transcribe_model = CaptionParser.quantize_whisper_model(transcribe_model)
+        elif backend == "cpu":
+            pass
+        elif cuda_is_available():
+            transcribe_model = transcribe_model.to(device)
+        else:
+            transcribe_model = transcribe_model.cpu()
+            warnings.warn("CUDA is not available, using CPU. Highly recommend using a GPU for faster inference.")
+
+        return transcribe_model
+
+    def parse_captions_with_whisper(self) -> dict:
+        if self.transcribe_model is None:
+            with self.profiler.stage("model_load"):
+                self.transcribe_model = self.load_whisper_model(self.model_name, self.backend, self.threads)
+
+        print(f"Transcribing {self.video_path} with {self.model_name} model")
+        with self.profiler.stage("transcription"):
+            if self.batch_size > 0:
+                segments = self.do_whisper_transcribe_batched()
+            elif self.use_vad:
+                print(f"Transcribing {len(self.speech_segments)} speech chunks detected by VAD")
+                segments = self.do_whisper_transcribe_chunks()
+            else:
+                segments = self.do_whisper_transcribe()
+        print(f"Transcription complete with {len(segments)} segments")
+
+        return self.save_captions(segments)
+
+    @staticmethod
+    def load_huggingface_model(model_path: str, dtype: str = None):
+        """
+        Load a downloaded Hugging Face speech recognition model as a transformers pipeline.
+        `dtype` is float32, float16 or bfloat16, half precision is only used on CUDA.
+        """
+        from transformers import pipeline
+
+        dtype = dtype or get_model_config()["huggingface"]["dtype"]
         if not cuda_is_available():
             warnings.warn("CUDA is not available, using CPU. Highly recommend using a GPU for faster inference.")
+            dtype = "float32"
 
-        model = pipeline(
+        return pipeline(
             task="automatic-speech-recognition",
-            model=self.model_path,
-            chunk_length_s=5,
-            stride_length_s=1,
+            model=model_path,
+            torch_dtype=getattr(torch, dtype),
             model_kwargs={
                 "attn_implementation": "sdpa",
             },
             device=0 if cuda_is_available() else -1
         )
 
-        print(f"Transcribing {self.video_path} with {self.model_name} model")
-        output = model(
-            inputs=self.audio_path,
+    def do_huggingface_transcribe(self, inputs: list, **kwargs) -> list:
+        outputs = self.transcribe_model(
+            inputs,
+            batch_size=self.batch_size or get_model_config()["huggingface"]["batch_size"],
             return_timestamps=True,
             generate_kwargs={
                 "language": self.language,
                 "task": "transcribe"
-            }
+            },
+            **kwargs
         )
-        print(f"Transcription complete with {len(output['chunks'])} segments")
+        return [
+            [{"start": chunk["timestamp"][0], "end": chunk["timestamp"][1], "text": chunk["text"]}
+             for chunk in output["chunks"]]
+            for output in outputs
+        ]
 
-        sentences = {}
-        for segment in output['chunks']:
-            sentences[(round(segment['timestamp'][0], 2), round(segment['timestamp'][1], 2))] = segment['text']
+    def parse_captions_with_huggingface(self) -> dict:
+        """
+        With VAD the speech chunks are batched through the pipeline as they are, without it the pipeline cuts
+        the whole audio into windows of `chunk_length_s` seconds overlapping by `stride_length_s`.
+        """
+        huggingface_config = get_model_config()["huggingface"]
+        if self.transcribe_model is None:
+            with self.profiler.stage("model_load"):
+                self.transcribe_model = self.load_huggingface_model(self.model_path, self.dtype)
 
-        self.write_captions(sentences)
-        print(f"Captions written to ./output_txt/{self.video_path.split('/')[-1].replace('.mp4', '.txt')}")
+        print(f"Transcribing {self.video_path} with {self.model_name} model")
+        with self.profiler.stage("transcription"):
+            windows = self.speech_segments if self.use_vad else [(0, len(self.audio) / SAMPLE_RATE)]
+            chunking = {} if self.use_vad else {"chunk_length_s": huggingface_config["chunk_length_s"],
+                                                "stride_length_s": huggingface_config["stride_length_s"]}
+            window_segments, keys, pending = self.load_cached_windows(windows, "huggingface", use_vad=self.use_vad,
+                                                                      **chunking)
+            if pending:
+                inputs = [{"raw": self.get_window_audio(window).numpy(), "sampling_rate": SAMPLE_RATE}
+                          for window in pending]
+                for window, segments in zip(pending, self.do_huggingface_transcribe(inputs, **chunking)):
+                    window_segments[window] = segments
+                    self.cache_window(keys, window, segments)
 
-        return sentences
+            segments = []
+            for start, end in windows:
+                for segment in window_segments[(start, end)]:
+                    # The last timestamp of a window is open ended when the speech runs to its end.
+                    if segment["end"] is None:
+                        segment = dict(segment, end=end - start)
+                    segments.append(self.offset_segment(segment, start, end))
+        print(f"Transcription complete with {len(segments)} segments")
+
+        return self.save_captions(segments)
 
     def parse_captions(self) -> dict:
         assert self.video_path is not None, "Video path is required"
@@ -0,0 +1,94 @@
+import bisect
+import numpy as np
+
+from collections import OrderedDict
+
+# Rasterized captions kept in memory, captions are shown in time order so only the latest few are needed.
+BITMAP_CACHE_SIZE = 8
+
+
+class CaptionRenderer:
+    def __init__(self, caption_config: dict, frame_width: int, frame_height: int):
+        """
+        Burn captions into frames without moviepy compositing.
+        Frames look up the active caption through an index sorted by start time, a caption is rasterized to
+        uint8 bitmaps when it first shows up, and frames without a caption are passed through untouched.
+        """
+        self.caption_config = caption_config
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+
+        self.starts = []
+        self.captions = []
+        self.bitmaps = OrderedDict()
+
+    def rasterize(self, text: str) -> tuple:
+        from moviepy.video.VideoClip import TextClip
+
+        text_clip = TextClip(
+            text=text,
+            font=self.caption_config["font"],
+            font_size=self.caption_config["font_size"],
+            color=self.caption_config["color"],
+            stroke_color=self.caption_config["stroke_color"],
+            stroke_width=self.caption_config["stroke_width"],
+            duration=1,
+        )
+        rgb = text_clip.get_frame(0).astype(np.uint8)
+        alpha = np.round(text_clip.mask.get_frame(0) * 255).astype(np.uint8)[:, :, None]
+        text_clip.close()
+
+        # Crop to the part of the frame the caption covers.
+        height, width = alpha.shape[:2]
+        x = max(0, (self.frame_width - width) // 2)
+        y = max(0, min(self.frame_height - self.caption_config["y_position"], self.frame_height - height))
+        width = min(width, self.frame_width - x)
+        height = min(height, self.frame_height - y)
+
+        return x, y, rgb[:height, :width], alpha[:height, :width]
+
+    def add_caption(self, start: float, end: float, text: str) -> None:
+        index = bisect.bisect_right(self.starts, start)
+        self.starts.insert(index, start)
+        self.captions.insert(index, (start, end, text.strip()))
+
+    def get_bitmap(self, text: str) -> tuple:
+        if text in self.bitmaps:
+            self.bitmaps.move_to_end(text)
+        else:
+            self.bitmaps[text] = self.rasterize(text)
+            if len(self.bitmaps) > BITMAP_CACHE_SIZE:
+                self.bitmaps.popitem(last=False)
+        return self.bitmaps[text]
+
+    def get_active_caption(self, t: float):
+        index = bisect.bisect_right(self.starts, t) - 1
+        if index < 0 or t >= self.captions[index][1]:
+            return None
+        return self.captions[index]
+
+    def get_opacity(self, start: float, end: float, t: float) -> float:
+        opacity = 1.0
+        if self.caption_config["fade_in"] > 0:
+            opacity = min(opacity, (t - start) / self.caption_config["fade_in"])
+        if self.caption_config["fade_out"] > 0:
+            opacity = min(opacity, (end - t) / self.caption_config["fade_out"])
+        return max(0.0, min(1.0, opacity))
+
+    def render_frame(self, get_frame, t: float) -> np.ndarray:
+        frame = get_frame(t)
+        caption = self.get_active_caption(t)
+        if caption is None:
+            return frame
+
+        start, end, text = caption
+        x, y, rgb, alpha = self.get_bitmap(text)
+        alpha = alpha.astype(np.float32) * (self.get_opacity(start, end, t) / 255)
+        frame = frame.copy()
+        region = frame[y:y + rgb.shape[0], x:x + rgb.shape[1]].astype(np.float32)
+        blended = region + (rgb.astype(np.float32) - region) * alpha
+        frame[y:y + rgb.shape[0], x:x + rgb.shape[1]] = blended.astype(np.uint8)
+        return frame
+
+    def apply(self, video_clip):
+        return video_clip.transform(self.render_frame, apply_to=[])
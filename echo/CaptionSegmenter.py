@@ -0,0 +1,175 @@
+import re
+import json
+import math
+import hashlib
+
+# Sentence final punctuation, a caption may end after it even when it has room for more words.
+SENTENCE_END = tuple(".?!。？！")
+# CJK characters are words of their own, they are not separated by spaces.
+CJK = "\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af"
+WORD_PATTERN = re.compile(rf"\s*(?:[{CJK}]|[^\s{CJK}]+)")
+
+
+class CaptionSegmenter:
+    def __init__(self, caption_config: dict):
+        """
+        Re-chunk the words of transcript segments into captions limited by the segmentation settings of
+        caption_config.yaml: characters per line, lines, duration and reading speed, with a minimum gap between
+        captions. Captions too short for the fades are lengthened into the following silence instead of dropped.
+
+        Captions never span segments and only depend on their own segment and the start of the next one,
+        so one pass over the segments is linear, and correcting a segment only re-times its own captions
+        and the last caption of the segment before it.
+
+        Segments may carry their captions, stored with the `key` of the settings they were made with;
+        they are reused as long as the settings did not change.
+        """
+        settings = caption_config["segmentation"]
+        self.max_chars_per_line = settings["max_chars_per_line"]
+        self.max_lines = settings["max_lines"]
+        self.max_duration = settings["max_duration"]
+        self.min_duration = max(settings["min_duration"], caption_config["fade_in"] + caption_config["fade_out"])
+        self.min_gap = settings["min_gap"]
+        self.max_chars_per_second = settings["max_chars_per_second"]
+
+        self.key = hashlib.sha1(json.dumps([settings, self.min_duration], sort_keys=True).encode()).hexdigest()[:16]
+        self.max_chars = min(self.max_chars_per_line * self.max_lines,
+                             int(self.max_chars_per_second * self.max_duration))
+
+    @staticmethod
+    def get_words(segment: dict) -> list:
+        """
+        The (start, end, word) of a segment. Segments without word timestamps, or whose text was corrected
+        after transcription, have their time shared out between their words by length.
+        """
+        text = segment["text"].strip()
+        words = segment.get("words") or []
+        if words and "".join(word["word"] for word in words).strip() == text:
+            return [(word["start"], word["end"], word["word"]) for word in words]
+
+        tokens = WORD_PATTERN.findall(text)
+        total = sum(len(token.strip()) for token in tokens)
+        words, start = [], segment["start"]
+        for token in tokens:
+            end = start + (segment["end"] - segment["start"]) * len(token.strip()) / total
+            words.append((start, end, token))
+            start = end
+        return words
+
+    def first_start(self, segment: dict) -> float:
+        words = self.get_words(segment)
+        return words[0][0] if words else segment["start"]
+
+    def wrap(self, words: list) -> str:
+        """
+        Break the text of a caption into balanced lines at word boundaries.
+        """
+        text = "".join(word for _, _, word in words).strip()
+        line_count = math.ceil(len(text) / self.max_chars_per_line)
+        if line_count <= 1:
+            return text
+
+        target = math.ceil(len(text) / line_count)
+        tokens = [word for _, _, word in words]
+        lines = self.fill(tokens, lambda line, word: abs(len((line + word).strip()) - target) > abs(len(line) - target))
+        if len(lines) > line_count or max(len(line) for line in lines) > self.max_chars_per_line:
+            lines = self.fill(tokens, lambda line, word: len((line + word).strip()) > self.max_chars_per_line)
+        return "\n".join(lines)
+
+    @staticmethod
+    def fill(words: list, is_full) -> list:
+        lines, line = [], ""
+        for word in words:
+            if line.strip() and is_full(line.strip(), word):
+                lines.append(line.strip())
+                line = word
+            else:
+                line += word
+        lines.append(line.strip())
+        return lines
+
+    def split(self, segment: dict) -> list:
+        """
+        Greedily group the words of a segment into (start, end, text) captions timed by their words.
+        """
+        captions, current, text = [], [], ""
+        line_count, line = 0, ""
+        for word in self.get_words(segment):
+            # Greedy line filling, which the wrapped caption never needs more lines than.
+            if line.strip() and len((line + word[2]).strip()) > self.max_chars_per_line:
+                new_line_count, new_line = line_count + 1, word[2]
+            else:
+                new_line_count, new_line = max(line_count, 1), line + word[2]
+
+            if current and (new_line_count > self.max_lines
+                            or len((text + word[2]).strip()) > self.max_chars
+                            or word[1] - current[0][0] > self.max_duration):
+                captions.append((current[0][0], current[-1][1], self.wrap(current)))
+                current, text = [], ""
+                new_line_count, new_line = 1, word[2]
+            current.append(word)
+            text += word[2]
+            line_count, line = new_line_count, new_line
+
+            if word[2].strip().endswith(SENTENCE_END) and len(text.strip()) >= self.max_chars_per_line // 2:
+                captions.append((current[0][0], current[-1][1], self.wrap(current)))
+                current, text = [], ""
+                line_count, line = 0, ""
+        if current:
+            captions.append((current[0][0], current[-1][1], self.wrap(current)))
+        return captions
+
+    def retime(self, captions: list, next_start: float) -> list:
+        """
+        Keep every caption on screen long enough to read and for its fades, without running into the caption
+        after it. `next_start` is where the captions of the next segment begin.
+        """
+        timed = []
+        for index, (start, end, text) in enumerate(captions):
+            limit = (captions[index + 1][0] if index + 1 < len(captions) else next_start) - self.min_gap
+            chars = len(text.replace("\n", ""))
+            end = max(end, start + chars / self.max_chars_per_second, start + self.min_duration)
+            end = max(min(end, limit), start + 0.01)
+            timed.append((round(start, 3), round(end, 3), text))
+        return timed
+
+    def segment_captions(self, segment: dict, next_segment: dict = None) -> list:
+        """
+        The captions of one segment, e.g. after a correction, followed by `next_segment` or by nothing.
+        """
+        next_start = self.first_start(next_segment) if next_segment else float("inf")
+        return self.retime(self.split(segment), next_start)
+
+    def get_captions(self, segment: dict, next_segment: dict = None) -> list:
+        """
+        The stored captions of a segment if they were made with the current settings, else `segment_captions`.
+        """
+        if segment.get("captions_key") == self.key:
+            return [tuple(caption) for caption in segment["captions"]]
+        return self.segment_captions(segment, next_segment)
+
+    def get_caption_fields(self, segments: list) -> list:
+        """
+        The fields storing the captions of each of the ordered segments, None for segments without text.
+        """
+        fields = [None] * len(segments)
+        next_segment = None
+        for i in reversed(range(len(segments))):
+            if segments[i]["text"].strip():
+                fields[i] = {"captions": self.segment_captions(segments[i], next_segment), "captions_key": self.key}
+                next_segment = segments[i]
+        return fields
+
+    def iter_captions(self, segments):
+        """
+        Yield the captions of ordered segments, holding one segment at a time.
+        """
+        previous = None
+        for segment in segments:
+            if not segment["text"].strip():
+                continue
+            if previous is not None:
+                yield from self.get_captions(previous, segment)
+            previous = segment
+        if previous is not None:
+            yield from self.get_captions(previous)
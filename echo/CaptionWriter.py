@@ -1,28 +1,50 @@
 import os
-import re
-import yaml
-import pysrt
+import json
+import subprocess
 
-from moviepy.video import fx
-from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
-from moviepy import VideoFileClip
-from moviepy.video.VideoClip import TextClip
+from echo.CaptionRenderer import CaptionRenderer
+from echo.CaptionSegmenter import CaptionSegmenter
+from echo.SubtitleWriter import SrtWriter, AssWriter
+from echo.TranscriptStore import get_transcript_path, iter_segments
+from echo.Profiler import Profiler
+from echo.config import get_caption_config
 
 
 class CaptionWriter:
-    def __init__(self, video_path: str):
-        self.caption_config = yaml.load(
-            open("./conf/caption_config.yaml", "r", encoding="utf-8"),
-            Loader=yaml.FullLoader
-        )
+    def __init__(self, video_path: str, renderer: str = "fast", profiler: Profiler = None):
+        self.caption_config = get_caption_config()
         self.video_path = video_path
-        self.video_clip = VideoFileClip(video_path)
-        self.frame_height = self.video_clip.h
-        self.frame_width = self.video_clip.w
+        self.renderer = renderer
+        self.profiler = profiler or Profiler()
+        if self.renderer == "ffmpeg":
+            # ffmpeg does all the decoding, only the frame size is needed.
+            self.video_clip = None
+            self.frame_width, self.frame_height, self.profiler.media_duration = self.probe_video(video_path)
+        else:
+            # moviepy is only imported by the renderers that decode frames in Python.
+            from moviepy import VideoFileClip
+
+            self.video_clip = VideoFileClip(video_path)
+            self.frame_height = self.video_clip.h
+            self.frame_width = self.video_clip.w
+            self.profiler.media_duration = self.video_clip.duration
 
         self.caption_clips = []
 
+    @staticmethod
+    def probe_video(video_path: str) -> tuple:
+        output = json.loads(subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=width,height:format=duration",
+             "-of", "json", video_path],
+            capture_output=True, check=True
+        ).stdout)
+        stream = output["streams"][0]
+        return stream["width"], stream["height"], float(output["format"]["duration"])
+
     def generate_caption_clips(self, start: float, end: float, text: str) -> None:
+        from moviepy.video import fx
+        from moviepy.video.VideoClip import TextClip
+
         text_clip = TextClip(
             text=text,
             font=self.caption_config["font"],
@@ -42,34 +64,51 @@ class CaptionWriter:
 
         self.caption_clips.append(text_clip)
 
-    def generate_caption_clips_and_srt(self) -> None:
-        txt_path = os.path.join("./output_txt", self.video_path.split("/")[-1].replace(".mp4", ".txt"))
-
-        with open(txt_path, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-            subs = []
-            line_count = 0
-            for line in lines:
-                line_count += 1
-
-                if not re.match(r"^(\d+\.\d+)-(\d+\.\d+): (.+)$", line):
-                    continue
-
-                start = float(line.split("-")[0])
-                end = float(line.split(":")[0].split("-")[1])
-                text = line.split(": ")[1]
+    def read_captions(self) -> list:
+        """
+        Read the (start, end, text) captions of the video, re-chunked from the words of its transcript.
+        """
+        return list(CaptionSegmenter(self.caption_config).iter_captions(iter_segments(self.video_path)))
 
-                if end - start < self.caption_config["fade_in"] + self.caption_config["fade_out"]:
-                    continue
+    def write_srt(self, captions: list) -> None:
+        srt_path = os.path.join("./output_srt", self.video_path.split("/")[-1].replace(".mp4", ".srt"))
+        with open(srt_path, "w", encoding="utf-8") as f:
+            srt_writer = SrtWriter(f)
+            for start, end, text in captions:
+                srt_writer.write_cue(start, end, text)
 
-                self.generate_caption_clips(start, end, text)
-
-                subs.append(pysrt.SubRipItem(index=len(subs), start=pysrt.srttime.SubRipTime(seconds=start),
-                                             end=pysrt.srttime.SubRipTime(seconds=end), text=text))
-
-            subs = pysrt.SubRipFile(subs)
-
-            subs.save(os.path.join("./output_srt", self.video_path.split("/")[-1].replace(".mp4", ".srt")))
+    def generate_caption_clips_and_srt(self) -> None:
+        captions = self.read_captions()
+        for start, end, text in captions:
+            self.generate_caption_clips(start, end, text)
+        self.write_srt(captions)
+
+    def write_ass(self, captions: list) -> str:
+        ass_path = os.path.join("./output_srt", self.video_path.split("/")[-1].replace(".mp4", ".ass"))
+        with open(ass_path, "w", encoding="utf-8") as f:
+            ass_writer = AssWriter(f, self.caption_config, self.frame_width, self.frame_height)
+            for start, end, text in captions:
+                ass_writer.write_cue(start, end, text)
+        return ass_path
+
+    @staticmethod
+    def escape_filter_path(path: str) -> str:
+        return "'" + os.path.abspath(path).replace("\\", "/").replace(":", "\\:") + "'"
+
+    def burn_with_ffmpeg(self, ass_path: str, output_path: str) -> None:
+        """
+        Burn the ASS captions in with a single ffmpeg run, copying the audio stream as is.
+        """
+        fonts_dir = os.path.dirname(self.caption_config["font"]) or "."
+        subprocess.run(
+            ["ffmpeg", "-y", "-nostdin", "-loglevel", "error", "-stats",
+             "-i", self.video_path,
+             "-vf", f"ass={self.escape_filter_path(ass_path)}:fontsdir={self.escape_filter_path(fonts_dir)}",
+             "-c:v", "libx264", "-preset", "ultrafast",
+             "-c:a", "copy",
+             output_path],
+            check=True
+        )
 
     def write_captions(self, video_path: str) -> None:
         os.makedirs("./output_srt", exist_ok=True)
@@ -78,16 +117,41 @@ class CaptionWriter:
         print(f"Writing captions to video {video_path}...")
 
         txt_path = os.path.join("./output_txt", video_path.split("/")[-1].replace(".mp4", ".txt"))
-        if not os.path.exists(txt_path):
+        if not os.path.exists(get_transcript_path(video_path)) and not os.path.exists(txt_path):
             raise FileNotFoundError(f"Captions file not found. Please run parse mode first.")
 
-        self.generate_caption_clips_and_srt()
-
-        self.caption_clips.insert(0, self.video_clip)
-
-        final = CompositeVideoClip(self.caption_clips)
-        final.write_videofile(os.path.join("./output_video", video_path.split("/")[-1]),
-                              audio_codec="aac", preset="ultrafast")
+        if self.renderer == "ffmpeg":
+            with self.profiler.stage("caption_generation"):
+                captions = self.read_captions()
+                self.write_srt(captions)
+                ass_path = self.write_ass(captions)
+            with self.profiler.stage("video_encode"):
+                self.burn_with_ffmpeg(ass_path, os.path.join("./output_video", video_path.split("/")[-1]))
+            return
+        elif self.renderer == "fast":
+            with self.profiler.stage("caption_generation"):
+                captions = self.read_captions()
+                self.write_srt(captions)
+
+                caption_renderer = CaptionRenderer(self.caption_config, self.frame_width, self.frame_height)
+                for start, end, text in captions:
+                    caption_renderer.add_caption(start, end, text)
+                final = caption_renderer.apply(self.video_clip)
+        else:
+            with self.profiler.stage("caption_generation"):
+                self.generate_caption_clips_and_srt()
+
+                self.caption_clips.insert(0, self.video_clip)
+                from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
+
+                final = CompositeVideoClip(self.caption_clips)
+
+        self.write_video(final)
+
+    def write_video(self, final) -> None:
+        with self.profiler.stage("video_encode"):
+            final.write_videofile(os.path.join("./output_video", self.video_path.split("/")[-1]),
+                                  audio_codec="aac", preset="ultrafast")
 
 
 if __name__ == "__main__":
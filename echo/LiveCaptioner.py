@@ -0,0 +1,136 @@
+import sys
+import torch
+import numpy as np
+
+from contextlib import redirect_stdout
+
+from silero_vad import load_silero_vad, VADIterator
+
+from echo.AudioStream import AudioStream, SAMPLE_RATE
+from echo.CaptionParser import CaptionParser
+from echo.SubtitleWriter import SrtWriter, VttWriter
+
+# Silero VAD takes 512 sample windows at 16 kHz.
+VAD_WINDOW = 512
+# Audio kept before a detected speech start, VAD reports starts slightly in the past.
+PRE_ROLL = SAMPLE_RATE
+
+
+class LiveCaptioner:
+    def __init__(self, source: str, model_name: str, language: str, output_path: str = "-",
+                 subtitle_format: str = "srt", max_latency: float = 5.0, follow: bool = False,
+                 realtime: bool = False, backend: str = "auto", threads: int = 0):
+        """
+        Caption a live audio source. Silero VAD runs incrementally on the stream, every utterance is transcribed
+        as soon as it closes and written out as an SRT or WebVTT cue right away.
+        Utterances longer than `max_latency` seconds are cut, so no cue is delayed by more than that
+        plus the transcription time.
+        """
+        self.source = source
+        self.model_name = model_name
+        self.language = language
+        self.output_path = output_path
+        self.subtitle_format = subtitle_format
+        self.max_latency = max_latency
+        self.follow = follow
+        self.realtime = realtime
+        self.backend = backend
+        self.threads = threads
+
+        self.transcribe_model = None
+        self.subtitle_writer = None
+        self.output_file = None
+
+        # Samples not yet transcribed, starting at sample index `buffer_start` of the stream.
+        self.buffer = []
+        self.buffer_start = 0
+        self.buffer_length = 0
+
+    def append_audio(self, window: np.ndarray) -> None:
+        self.buffer.append(window)
+        self.buffer_length += len(window)
+
+    def take_audio(self, start: int, end: int) -> np.ndarray:
+        """
+        Return samples [start, end) of the stream and drop everything before `end` from the buffer.
+        """
+        audio = np.concatenate(self.buffer) if self.buffer else np.zeros(0, np.float32)
+        start = max(start, self.buffer_start)
+        utterance = audio[start - self.buffer_start:end - self.buffer_start]
+
+        remaining = audio[max(0, end - self.buffer_start):]
+        self.buffer = [remaining] if len(remaining) else []
+        self.buffer_start = max(end, self.buffer_start)
+        self.buffer_length = len(remaining)
+        return utterance
+
+    def trim_audio(self) -> None:
+        # Outside an utterance only the pre-roll has to be kept.
+        if self.buffer_length > 2 * PRE_ROLL:
+            self.take_audio(self.buffer_start, self.buffer_start + self.buffer_length - PRE_ROLL)
+
+    def transcribe_utterance(self, start: int, end: int) -> None:
+        utterance = self.take_audio(start, end)
+        if len(utterance) < VAD_WINDOW:
+            return
+
+        offset = start / SAMPLE_RATE
+        output = self.transcribe_model.transcribe(
+            utterance,
+            language=self.language,
+            condition_on_previous_text=False
+        )
+        for segment in output["segments"]:
+            self.subtitle_writer.write_cue(offset + segment["start"], min(offset + segment["end"], end / SAMPLE_RATE),
+                                           segment["text"])
+        self.output_file.flush()
+
+    def run(self) -> None:
+        self.output_file = sys.stdout if self.output_path == "-" else open(self.output_path, "w", encoding="utf-8")
+        try:
+            # Subtitles may go to stdout, everything else printed meanwhile goes to stderr.
+            with redirect_stdout(sys.stderr):
+                self.caption()
+        finally:
+            if self.output_file is not sys.stdout:
+                self.output_file.close()
+
+    def caption(self) -> None:
+        self.transcribe_model = CaptionParser.load_whisper_model(self.model_name, self.backend, self.threads)
+        vad_iterator = VADIterator(load_silero_vad(onnx=False), sampling_rate=SAMPLE_RATE)
+
+        self.subtitle_writer = VttWriter(self.output_file) if self.subtitle_format == "vtt" \
+            else SrtWriter(self.output_file)
+
+        max_utterance = int(self.max_latency * SAMPLE_RATE)
+        utterance_start = None
+        position = 0
+        leftover = np.zeros(0, np.float32)
+        try:
+            audio_stream = AudioStream(self.source, SAMPLE_RATE, block_seconds=VAD_WINDOW / SAMPLE_RATE,
+                                       follow=self.follow, realtime=self.realtime)
+            for block in audio_stream:
+                leftover = np.concatenate([leftover, block])
+                while len(leftover) >= VAD_WINDOW:
+                    window, leftover = leftover[:VAD_WINDOW], leftover[VAD_WINDOW:]
+                    self.append_audio(window)
+                    position += VAD_WINDOW
+
+                    event = vad_iterator(torch.from_numpy(window))
+                    if event and "start" in event:
+                        utterance_start = event["start"]
+                    elif event and "end" in event and utterance_start is not None:
+                        self.transcribe_utterance(utterance_start, event["end"])
+                        utterance_start = None
+                    elif utterance_start is not None and position - utterance_start >= max_utterance:
+                        # Still speaking, cut here to keep the latency bounded.
+                        self.transcribe_utterance(utterance_start, position)
+                        utterance_start = position
+
+                    if utterance_start is None:
+                        self.trim_audio()
+
+            if utterance_start is not None:
+                self.transcribe_utterance(utterance_start, position)
+        finally:
+            vad_iterator.reset_states()
@@ -0,0 +1,82 @@
+import sys
+import json
+import time
+import platform
+
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is then not reported.
+    resource = None
+
+
+class Profiler:
+    def __init__(self):
+        """
+        Record wall time, CPU time, peak RSS and peak GPU memory of each named pipeline stage.
+        """
+        self.stages = []
+        self.media_duration = None
+
+    @staticmethod
+    def get_peak_rss_mb():
+        if resource is None:
+            return None
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes.
+        return round(peak_rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+    @staticmethod
+    def get_cuda():
+        # Only look at the GPU when torch is already loaded, the write pipeline does not need it.
+        torch = sys.modules.get("torch")
+        if torch is None or not torch.cuda.is_available():
+            return None
+        return torch.cuda
+
+    @contextmanager
+    def stage(self, name: str):
+        cuda = self.get_cuda()
+        if cuda is not None:
+            cuda.reset_peak_memory_stats()
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            self.stages.append({
+                "stage": name,
+                "wall_time": round(time.perf_counter() - wall_start, 3),
+                "cpu_time": round(time.process_time() - cpu_start, 3),
+                # Peak RSS is the high water mark of the whole process up to the end of the stage.
+                "peak_rss_mb": self.get_peak_rss_mb(),
+                "peak_gpu_mb": round(cuda.max_memory_allocated() / (1024 * 1024), 1) if cuda is not None else None
+            })
+
+    def report(self) -> dict:
+        wall_time = sum(stage["wall_time"] for stage in self.stages)
+        return {
+            "stages": self.stages,
+            "wall_time": round(wall_time, 3),
+            "media_duration": self.media_duration,
+            # Seconds of processing per second of media, below 1 is faster than real time.
+            "real_time_factor": round(wall_time / self.media_duration, 3) if self.media_duration else None
+        }
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=4)
+
+    @staticmethod
+    def get_environment() -> dict:
+        environment = {"python": platform.python_version(), "platform": platform.platform(),
+                       "processor": platform.processor()}
+        torch = sys.modules.get("torch")
+        if torch is not None:
+            environment["torch"] = torch.__version__
+            environment["cuda_device"] = torch.cuda.get_device_name() if torch.cuda.is_available() else None
+            environment["torch_threads"] = torch.get_num_threads()
+        return environment
@@ -0,0 +1,103 @@
+import os
+
+from multiprocessing import get_context
+
+import torch
+
+from echo.CaptionParser import CaptionParser
+
+
+def _transcribe_shard(device: str, model_name: str, backend: str, threads: int, language: str,
+                      chunks: list) -> list:
+    """
+    Load a model replica on `device` and transcribe the shard's (window, audio) chunks.
+    Returns (window, segments) with segment times relative to the window.
+    """
+    transcribe_model = CaptionParser.load_whisper_model(model_name, backend, threads, device)
+
+    results = []
+    for window, audio in chunks:
+        output = transcribe_model.transcribe(
+            audio,
+            language=language,
+            word_timestamps=True,
+            condition_on_previous_text=False
+        )
+        results.append((window, output["segments"]))
+        print(f"[{device}] transcribed {window[0]:.1f}-{window[1]:.1f}s")
+    return results
+
+
+class ShardedParser:
+    def __init__(self, caption_parser: CaptionParser, shards: int = 0):
+        """
+        Split one video's windows across every visible CUDA device, or across `shards` CPU processes
+        without CUDA, each running its own model replica, and merge the results into one timeline.
+        """
+        assert caption_parser.model_type == "whisper", "Sharding only supports Whisper models."
+        self.caption_parser = caption_parser
+
+        if torch.cuda.is_available() and caption_parser.backend == "auto":
+            self.devices = [f"cuda:{index}" for index in range(torch.cuda.device_count())]
+        else:
+            self.devices = ["cpu"] * max(1, shards or os.cpu_count() // 4)
+
+    def assign(self, windows: list) -> list:
+        """
+        Longest windows first, each to the shard with the least audio so far.
+        """
+        shards = [[] for _ in self.devices]
+        loads = [0.0] * len(self.devices)
+        for window in sorted(windows, key=lambda window: window[1] - window[0], reverse=True):
+            index = loads.index(min(loads))
+            shards[index].append(window)
+            loads[index] += window[1] - window[0]
+        return [sorted(shard) for shard in shards]
+
+    @staticmethod
+    def merge_segments(segments: list) -> list:
+        """
+        Order segments by time, drop repeats of the previous segment and cut overlaps at window boundaries.
+        """
+        merged = []
+        for segment in sorted(segments, key=lambda segment: (segment["start"], segment["end"])):
+            if merged and segment["start"] < merged[-1]["end"]:
+                if segment["text"].strip() == merged[-1]["text"].strip():
+                    continue
+                merged[-1] = dict(merged[-1], end=segment["start"])
+            merged.append(segment)
+        return merged
+
+    def parse_captions(self) -> dict:
+        caption_parser = self.caption_parser
+        windows = caption_parser.get_windows()
+
+        window_segments, keys, pending = caption_parser.load_cached_windows(windows, "chunk")
+        shards = [shard for shard in self.assign(pending) if shard]
+        threads = max(1, (os.cpu_count() or 1) // max(1, len(shards)))
+        print(f"Transcribing {len(pending)} windows of {caption_parser.video_path} on {len(shards)} shards, "
+              f"{len(windows) - len(pending)} windows loaded from cache")
+
+        with caption_parser.profiler.stage("transcription"):
+            if shards:
+                arguments = [
+                    (device, caption_parser.model_name, caption_parser.backend, caption_parser.threads or threads,
+                     caption_parser.language,
+                     [(window, caption_parser.get_window_audio(window).numpy()) for window in shard])
+                    for device, shard in zip(self.devices, shards)
+                ]
+                # Spawn instead of fork, forked workers can not initialise CUDA.
+                with get_context("spawn").Pool(len(shards)) as pool:
+                    for results in pool.starmap(_transcribe_shard, arguments):
+                        for window, segments in results:
+                            window_segments[window] = segments
+                            caption_parser.cache_window(keys, window, segments)
+
+            segments = []
+            for start, end in windows:
+                segments.extend(caption_parser.offset_segment(segment, start, end)
+                                for segment in window_segments[(start, end)])
+            segments = self.merge_segments(segments)
+        print(f"Transcription complete with {len(segments)} segments")
+
+        return caption_parser.save_captions(segments)
@@ -0,0 +1,226 @@
+import os
+import queue
+import threading
+import torch
+import numpy as np
+
+from echo.AudioStream import AudioStream, SAMPLE_RATE
+from echo.CaptionParser import CaptionParser
+from echo.CaptionWriter import CaptionWriter
+from echo.CaptionRenderer import CaptionRenderer
+from echo.CaptionSegmenter import CaptionSegmenter
+from echo.config import get_model_config
+
+# Silero VAD takes 512 sample windows at 16 kHz.
+VAD_WINDOW = 512
+# VAD reports a speech start slightly before the audio it has seen, no later speech starts earlier than this.
+VAD_LOOKBEHIND = 1.0
+
+
+class StreamingPipeline:
+    def __init__(self, video_path: str, model_name: str, model_path: str, model_type: str, language: str,
+                 use_vad: bool = False, use_cache: bool = True, queue_size: int = 8, backend: str = "auto",
+                 threads: int = 0):
+        """
+        Transcribe and burn in captions at the same time.
+        A producer thread streams the audio from ffmpeg, runs VAD on it as it arrives and transcribes every
+        window as soon as it closes, putting its segments on a bounded queue with a watermark.
+        The renderer takes them off the queue as the encoded video reaches their time.
+        """
+        assert model_type == "whisper", "Run mode only supports Whisper models."
+
+        self.parser_args = (video_path, model_name, model_path, model_type, language, use_vad)
+        self.use_vad = use_vad
+        self.max_chunk_length = get_model_config()["vad"]["max_chunk_length"]
+        self.max_merge_gap = get_model_config()["vad"]["max_merge_gap"]
+        self.use_cache = use_cache
+        self.backend = backend
+        self.threads = threads
+        self.video_path = video_path
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.segments = []
+        # Every segment starting before the watermark has been received.
+        self.watermark = 0.0
+        self.producer_watermark = 0.0
+        self.finished = False
+        # Captions of a segment are timed against the next one, the last segment received waits here for it.
+        self.pending = None
+
+        self.caption_writer = None
+        self.caption_segmenter = None
+        self.caption_renderer = None
+        self.caption_parser = None
+
+        # Audio received but not transcribed yet, starting at sample `audio_start`.
+        self.audio = np.zeros(0, np.float32)
+        self.audio_start = 0
+        self.position = 0
+        # Merged speech waiting for more speech to join it, and the start of the speech VAD is still in.
+        self.window = None
+        self.speech_start = None
+
+    def get_watermark(self) -> float:
+        """
+        No segment transcribed from now on can start before this time.
+        """
+        if not self.use_vad:
+            return self.window[0]
+        starts = [self.position / SAMPLE_RATE - VAD_LOOKBEHIND]
+        if self.window is not None:
+            starts.append(self.window[0])
+        if self.speech_start is not None:
+            starts.append(self.speech_start)
+        return max(0.0, min(starts))
+
+    def emit(self, start: float, end: float) -> None:
+        chunk = self.audio[int(start * SAMPLE_RATE) - self.audio_start:int(end * SAMPLE_RATE) - self.audio_start]
+        if len(chunk):
+            segments = self.caption_parser.transcribe_chunk(torch.from_numpy(chunk), start, end)
+            self.queue.put((self.get_watermark(), segments))
+
+    def add_speech(self, start: float, end: float) -> None:
+        # The incremental form of CaptionParser.get_speech_segments.
+        if self.window is not None and start - self.window[1] <= self.max_merge_gap \
+                and end - self.window[0] <= self.max_chunk_length:
+            self.window = (self.window[0], end)
+            return
+        self.close_window()
+        self.window = (start, end)
+
+    def close_window(self) -> None:
+        if self.window is not None:
+            window, self.window = self.window, None
+            self.emit(*window)
+
+    def receive_vad(self, vad_iterator, samples: np.ndarray) -> None:
+        event = vad_iterator(torch.from_numpy(samples))
+        self.position += len(samples)
+        time = self.position / SAMPLE_RATE
+
+        if event and "start" in event:
+            self.speech_start = event["start"] / SAMPLE_RATE
+        elif event and "end" in event and self.speech_start is not None:
+            speech_start, self.speech_start = self.speech_start, None
+            self.add_speech(speech_start, event["end"] / SAMPLE_RATE)
+
+        if self.speech_start is not None and time - self.speech_start >= self.max_chunk_length:
+            # Long speech is cut into chunks as it goes.
+            self.close_window()
+            speech_start, self.speech_start = self.speech_start, self.speech_start + self.max_chunk_length
+            self.emit(speech_start, self.speech_start)
+        if self.window is not None and self.speech_start is None \
+                and time - VAD_LOOKBEHIND - self.window[1] > self.max_merge_gap:
+            # No speech still to come can merge into the window any more.
+            self.close_window()
+
+    def transcribe(self) -> None:
+        try:
+            from silero_vad import VADIterator
+            from whisper.audio import CHUNK_LENGTH
+
+            self.caption_parser = CaptionParser(*self.parser_args, use_cache=self.use_cache, backend=self.backend,
+                                                extract_audio=False)
+            self.caption_parser.transcribe_model = CaptionParser.load_whisper_model(self.caption_parser.model_name,
+                                                                                    self.backend, self.threads)
+            vad_iterator = VADIterator(self.caption_parser.speech_recognition_model, sampling_rate=SAMPLE_RATE)
+            if not self.use_vad:
+                self.window = (0.0, float(CHUNK_LENGTH))
+
+            print(f"Transcribing {self.video_path} while its audio is decoded")
+            leftover = np.zeros(0, np.float32)
+            for block in AudioStream(self.video_path, SAMPLE_RATE, block_seconds=1.0):
+                self.audio = np.concatenate([self.audio, block])
+                if self.use_vad:
+                    leftover = np.concatenate([leftover, block])
+                    while len(leftover) >= VAD_WINDOW:
+                        samples, leftover = leftover[:VAD_WINDOW], leftover[VAD_WINDOW:]
+                        self.receive_vad(vad_iterator, samples)
+                else:
+                    self.position += len(block)
+                    while self.position >= self.window[1] * SAMPLE_RATE:
+                        # Fixed windows close as soon as all of their audio arrived.
+                        window, self.window = self.window, (self.window[1], self.window[1] + CHUNK_LENGTH)
+                        self.emit(*window)
+
+                # Set after the segments before it were queued, so the renderer can pass silence without waiting.
+                self.producer_watermark = self.get_watermark()
+                keep = int(self.get_watermark() * SAMPLE_RATE)
+                if keep > self.audio_start:
+                    self.audio = self.audio[keep - self.audio_start:]
+                    self.audio_start = keep
+
+            end = self.position / SAMPLE_RATE
+            if self.use_vad:
+                if self.speech_start is not None:
+                    self.add_speech(self.speech_start, end)
+                    self.speech_start = None
+                self.close_window()
+            elif self.window[0] < end:
+                self.emit(self.window[0], end)
+            self.queue.put(None)
+        except Exception as e:
+            self.queue.put(e)
+
+    def receive(self, t: float) -> None:
+        """
+        Block until every caption that can be visible at time `t` has been transcribed and segmented.
+        """
+        while not self.finished and (self.watermark <= t or (self.pending is not None and self.pending["start"] <= t)):
+            try:
+                item = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                # Read before checking the queue, segments before the producer's watermark are queued first.
+                producer_watermark = self.producer_watermark
+                if self.queue.empty():
+                    self.watermark = max(self.watermark, producer_watermark)
+                continue
+            if item is None:
+                self.finished = True
+                if self.pending is not None:
+                    self.add_captions(self.caption_segmenter.segment_captions(self.pending))
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                watermark, segments = item
+                self.watermark = max(self.watermark, watermark)
+                for segment in segments:
+                    self.segments.append(segment)
+                    if not segment["text"].strip():
+                        continue
+                    if self.pending is not None:
+                        self.add_captions(self.caption_segmenter.segment_captions(self.pending, segment))
+                    self.pending = segment
+
+    def add_captions(self, captions: list) -> None:
+        for start, end, text in captions:
+            self.caption_renderer.add_caption(start, end, text)
+
+    def render_frame(self, get_frame, t: float):
+        self.receive(t)
+        return self.caption_renderer.render_frame(get_frame, t)
+
+    def run(self) -> dict:
+        os.makedirs("./output_srt", exist_ok=True)
+        os.makedirs("./output_video", exist_ok=True)
+
+        transcribe_thread = threading.Thread(target=self.transcribe, daemon=True)
+        transcribe_thread.start()
+
+        self.caption_writer = CaptionWriter(self.video_path, "fast")
+        self.caption_renderer = CaptionRenderer(self.caption_writer.caption_config,
+                                                self.caption_writer.frame_width, self.caption_writer.frame_height)
+        self.caption_segmenter = CaptionSegmenter(self.caption_writer.caption_config)
+
+        print(f"Writing captions to video {self.video_path} while transcribing...")
+        self.caption_writer.write_video(self.caption_writer.video_clip.transform(self.render_frame, apply_to=[]))
+
+        # Segments past the end of the video still go to the text and srt outputs.
+        self.receive(float("inf"))
+        transcribe_thread.join()
+
+        sentences = self.caption_parser.save_captions(self.segments)
+        self.caption_writer.write_srt(self.caption_writer.read_captions())
+        print(f"Transcription complete with {len(self.segments)} segments")
+
+        return sentences
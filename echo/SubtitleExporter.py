@@ -0,0 +1,72 @@
+import os
+import warnings
+
+from echo.CaptionSegmenter import CaptionSegmenter
+from echo.SubtitleWriter import SrtWriter, VttWriter, AssWriter
+from echo.TranscriptStore import get_transcript_path, iter_segments
+from echo.config import get_caption_config
+
+SUBTITLE_FORMATS = ["srt", "vtt", "ass"]
+# ASS scripts need a frame size, used when the video is not there to probe.
+DEFAULT_FRAME_SIZE = (1920, 1080)
+
+
+class SubtitleExporter:
+    def __init__(self, video_path: str, formats: list = None, output_dir: str = "./output_srt"):
+        """
+        Write sidecar subtitles of a parsed video without touching its frames.
+        Captions stream from the transcript through the segmenter to every format's writer in one pass,
+        so memory does not grow with the number of captions.
+        """
+        self.caption_config = get_caption_config()
+        self.video_path = video_path
+        self.formats = formats or SUBTITLE_FORMATS
+        self.output_dir = output_dir
+
+        unknown = set(self.formats) - set(SUBTITLE_FORMATS)
+        assert not unknown, f"Unsupported subtitle formats {sorted(unknown)}, use {', '.join(SUBTITLE_FORMATS)}."
+
+    def get_frame_size(self) -> tuple:
+        if not os.path.exists(self.video_path):
+            warnings.warn(f"Video {self.video_path} not found, ASS subtitles use a "
+                          f"{DEFAULT_FRAME_SIZE[0]}x{DEFAULT_FRAME_SIZE[1]} frame.")
+            return DEFAULT_FRAME_SIZE
+
+        # ffprobe only reads the container headers, nothing is decoded.
+        from echo.CaptionWriter import CaptionWriter
+
+        frame_width, frame_height, _ = CaptionWriter.probe_video(self.video_path)
+        return frame_width, frame_height
+
+    def get_output_path(self, subtitle_format: str) -> str:
+        return os.path.join(self.output_dir, self.video_path.split("/")[-1].replace(".mp4", "." + subtitle_format))
+
+    def export(self) -> dict:
+        txt_path = os.path.join("./output_txt", self.video_path.split("/")[-1].replace(".mp4", ".txt"))
+        if not os.path.exists(get_transcript_path(self.video_path)) and not os.path.exists(txt_path):
+            raise FileNotFoundError(f"Captions file not found. Please run parse mode first.")
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        paths = {subtitle_format: self.get_output_path(subtitle_format) for subtitle_format in self.formats}
+        files = {subtitle_format: open(path, "w", encoding="utf-8", buffering=1024 * 1024)
+                 for subtitle_format, path in paths.items()}
+        try:
+            writers = []
+            if "srt" in files:
+                writers.append(SrtWriter(files["srt"]))
+            if "vtt" in files:
+                writers.append(VttWriter(files["vtt"]))
+            if "ass" in files:
+                writers.append(AssWriter(files["ass"], self.caption_config, *self.get_frame_size()))
+
+            count = 0
+            for start, end, text in CaptionSegmenter(self.caption_config).iter_captions(iter_segments(self.video_path)):
+                for writer in writers:
+                    writer.write_cue(start, end, text)
+                count += 1
+        finally:
+            for f in files.values():
+                f.close()
+
+        print(f"Exported {count} captions to {', '.join(paths.values())}")
+        return paths
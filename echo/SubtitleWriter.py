@@ -0,0 +1,113 @@
+import os
+
+# Colour names accepted in caption_config.yaml, as RRGGBB.
+COLOR_NAMES = {
+    "white": "FFFFFF",
+    "black": "000000",
+    "red": "FF0000",
+    "green": "00FF00",
+    "blue": "0000FF",
+    "yellow": "FFFF00",
+    "cyan": "00FFFF",
+    "magenta": "FF00FF",
+    "gray": "808080",
+    "grey": "808080",
+}
+
+
+class SrtWriter:
+    def __init__(self, file):
+        self.file = file
+        self.index = 0
+
+    @staticmethod
+    def to_srt_time(seconds: float) -> str:
+        milliseconds = int(round(seconds * 1000))
+        return f"{milliseconds // 3600000:02d}:{milliseconds // 60000 % 60:02d}:{milliseconds // 1000 % 60:02d}," \
+               f"{milliseconds % 1000:03d}"
+
+    def write_cue(self, start: float, end: float, text: str) -> None:
+        self.index += 1
+        self.file.write(f"{self.index}\n{self.to_srt_time(start)} --> {self.to_srt_time(end)}\n{text.strip()}\n\n")
+
+
+class VttWriter:
+    def __init__(self, file):
+        self.file = file
+        self.file.write("WEBVTT\n\n")
+
+    @staticmethod
+    def to_vtt_time(seconds: float) -> str:
+        return SrtWriter.to_srt_time(seconds).replace(",", ".")
+
+    @staticmethod
+    def escape_text(text: str) -> str:
+        return text.strip().replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+    def write_cue(self, start: float, end: float, text: str) -> None:
+        self.file.write(f"{self.to_vtt_time(start)} --> {self.to_vtt_time(end)}\n{self.escape_text(text)}\n\n")
+
+
+class AssWriter:
+    def __init__(self, file, caption_config: dict, frame_width: int, frame_height: int):
+        """
+        Write captions as an Advanced SubStation Alpha script styled after caption_config.yaml,
+        so that ffmpeg's ass filter renders them like the Python renderers do.
+        """
+        self.file = file
+        self.caption_config = caption_config
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+
+        self.write_header()
+
+    @staticmethod
+    def to_ass_color(color: str) -> str:
+        rgb = COLOR_NAMES.get(color.lower(), color.lstrip("#")).upper()
+        assert len(rgb) == 6, f"Unsupported color {color}, use a color name or #RRGGBB."
+        return f"&H00{rgb[4:6]}{rgb[2:4]}{rgb[0:2]}"
+
+    @staticmethod
+    def to_ass_time(seconds: float) -> str:
+        centiseconds = int(round(seconds * 100))
+        return f"{centiseconds // 360000}:{centiseconds // 6000 % 60:02d}:{centiseconds // 100 % 60:02d}." \
+               f"{centiseconds % 100:02d}"
+
+    @staticmethod
+    def escape_text(text: str) -> str:
+        return text.strip().replace("\\", "\\\\").replace("{", "\\{").replace("}", "\\}").replace("\n", "\\N")
+
+    def write_header(self) -> None:
+        # The font is configured as a file, libass looks it up by family name in the font's directory.
+        font_name = os.path.splitext(os.path.basename(self.caption_config["font"]))[0]
+        # Alignment 8 anchors the top of the text, MarginV puts it at the same height as the Python renderers.
+        margin_v = max(0, self.frame_height - self.caption_config["y_position"])
+
+        self.file.write(
+            "[Script Info]\n"
+            "ScriptType: v4.00+\n"
+            f"PlayResX: {self.frame_width}\n"
+            f"PlayResY: {self.frame_height}\n"
+            "WrapStyle: 0\n"
+            "ScaledBorderAndShadow: yes\n"
+            "\n"
+            "[V4+ Styles]\n"
+            "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, "
+            "Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, "
+            "Alignment, MarginL, MarginR, MarginV, Encoding\n"
+            f"Style: Default,{font_name},{self.caption_config['font_size']},"
+            f"{self.to_ass_color(self.caption_config['color'])},&H000000FF,"
+            f"{self.to_ass_color(self.caption_config['stroke_color'])},&H00000000,"
+            f"0,0,0,0,100,100,0,0,1,{self.caption_config['stroke_width']},0,8,10,10,{margin_v},1\n"
+            "\n"
+            "[Events]\n"
+            "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n"
+        )
+
+    def write_cue(self, start: float, end: float, text: str) -> None:
+        fade_in = int(self.caption_config["fade_in"] * 1000)
+        fade_out = int(self.caption_config["fade_out"] * 1000)
+        self.file.write(
+            f"Dialogue: 0,{self.to_ass_time(start)},{self.to_ass_time(end)},Default,,0,0,0,,"
+            f"{{\\fad({fade_in},{fade_out})}}{self.escape_text(text)}\n"
+        )
@@ -0,0 +1,217 @@
+import os
+import re
+import json
+import math
+import bisect
+import struct
+
+# One index record per segment: start, end, byte offset and byte length of its current line in the .jsonl file.
+INDEX_RECORD = struct.Struct("<ddqq")
+
+
+def get_transcript_path(video_path: str) -> str:
+    return os.path.join("./output_transcript", video_path.split("/")[-1].replace(".mp4", ".jsonl"))
+
+
+def iter_segments(video_path: str):
+    """
+    Yield the segments of a parsed video in order from its transcript store, or from its ./output_txt file
+    when that was changed later, e.g. corrected with tools/convert_with_your_txt.py -tgt_txt or by hand,
+    or when the video was parsed before there was a transcript store.
+    """
+    transcript_path = get_transcript_path(video_path)
+    txt_path = os.path.join("./output_txt", video_path.split("/")[-1].replace(".mp4", ".txt"))
+    if os.path.exists(transcript_path) and \
+            (not os.path.exists(txt_path) or os.path.getmtime(transcript_path) >= os.path.getmtime(txt_path)):
+        yield from iter_transcript(transcript_path)
+        return
+
+    with open(txt_path, "r", encoding="utf-8") as f:
+        for line in f:
+            match = re.match(r"^(\d+\.\d+)-(\d+\.\d+): (.+)$", line)
+            if match:
+                yield {"start": float(match.group(1)), "end": float(match.group(2)), "text": match.group(3)}
+
+
+def to_record(segment: dict) -> dict:
+    """
+    Keep the fields of a transcribed segment worth storing: times, text, word timestamps and confidence.
+    """
+    record = {"start": float(segment["start"]), "end": float(segment["end"]), "text": segment["text"].strip()}
+    if segment.get("words"):
+        record["words"] = [
+            {"start": float(word["start"]), "end": float(word["end"]), "word": word["word"],
+             "probability": float(word["probability"]) if "probability" in word else None}
+            for word in segment["words"]
+        ]
+    record["confidence"] = round(math.exp(segment["avg_logprob"]), 4) if "avg_logprob" in segment else None
+    return record
+
+
+class TranscriptWriter:
+    def __init__(self, path: str, overwrite: bool = False):
+        """
+        Append-only transcript store. Segments are JSON lines in `path`, a fixed size binary index next to it
+        (`path` + ".idx") gives their times and byte offsets.
+        Edits append the new version of a segment and repoint its index record, nothing is rewritten.
+        """
+        self.path = path
+        self.index_path = path + ".idx"
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        mode = "w+b" if overwrite or not os.path.exists(path) else "r+b"
+        self.file = open(path, mode)
+        self.index_file = open(self.index_path, mode if os.path.exists(self.index_path) else "w+b")
+        self.file.seek(0, os.SEEK_END)
+        self.index_file.seek(0, os.SEEK_END)
+        self.count = self.index_file.tell() // INDEX_RECORD.size
+        self.last_start = self.read_index(self.count - 1)[0] if self.count else float("-inf")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read_index(self, segment_id: int) -> tuple:
+        self.index_file.seek(segment_id * INDEX_RECORD.size)
+        record = INDEX_RECORD.unpack(self.index_file.read(INDEX_RECORD.size))
+        self.index_file.seek(0, os.SEEK_END)
+        return record
+
+    def write_line(self, record: dict) -> tuple:
+        self.file.seek(0, os.SEEK_END)
+        offset = self.file.tell()
+        data = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        self.file.write(data)
+        return offset, len(data)
+
+    def append(self, segment: dict, **fields) -> int:
+        """
+        Append a segment, with extra `fields` such as its captions, and return its id.
+        Segments must be appended in order of start time.
+        """
+        record = to_record(segment)
+        record.update(fields)
+        if record["start"] < self.last_start:
+            raise ValueError(f"Segment starting at {record['start']} appended after one starting at {self.last_start}")
+
+        record["id"] = self.count
+        offset, length = self.write_line(record)
+        self.index_file.seek(0, os.SEEK_END)
+        self.index_file.write(INDEX_RECORD.pack(record["start"], record["end"], offset, length))
+
+        self.count += 1
+        self.last_start = record["start"]
+        return record["id"]
+
+    def update(self, segment_id: int, **fields) -> dict:
+        """
+        Change fields of a stored segment, e.g. its text after a manual correction.
+        Its stored captions are dropped unless they are updated along.
+        """
+        start, end, offset, length = self.read_index(segment_id)
+        self.file.seek(offset)
+        record = json.loads(self.file.read(length))
+        if "captions" not in fields:
+            record.pop("captions", None)
+            record.pop("captions_key", None)
+        record.update(fields)
+
+        offset, length = self.write_line(record)
+        self.index_file.seek(segment_id * INDEX_RECORD.size)
+        self.index_file.write(INDEX_RECORD.pack(record["start"], record["end"], offset, length))
+        self.index_file.seek(0, os.SEEK_END)
+        return record
+
+    def flush(self) -> None:
+        self.file.flush()
+        self.index_file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+        self.index_file.close()
+
+
+class TranscriptReader:
+    def __init__(self, path: str):
+        """
+        Random access to a transcript store. Only the index is loaded, segments are read from disk when asked for.
+        """
+        self.path = path
+        with open(path + ".idx", "rb") as f:
+            records = list(INDEX_RECORD.iter_unpack(f.read()))
+        self.starts = [record[0] for record in records]
+        self.ends = [record[1] for record in records]
+        self.locations = [(record[2], record[3]) for record in records]
+        self.file = open(path, "rb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, segment_id: int) -> dict:
+        offset, length = self.locations[segment_id]
+        self.file.seek(offset)
+        return json.loads(self.file.read(length))
+
+    def __iter__(self):
+        for segment_id in range(len(self)):
+            yield self[segment_id]
+
+    def find(self, t: float):
+        """
+        The segment shown at time `t`, or None.
+        """
+        segment_id = bisect.bisect_right(self.starts, t) - 1
+        if segment_id < 0 or t >= self.ends[segment_id]:
+            return None
+        return self[segment_id]
+
+    def between(self, start: float, end: float):
+        """
+        Yield the segments overlapping [start, end).
+        """
+        segment_id = max(0, bisect.bisect_right(self.starts, start) - 1)
+        while segment_id < len(self) and self.starts[segment_id] < end:
+            if self.ends[segment_id] > start:
+                yield self[segment_id]
+            segment_id += 1
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def iter_transcript(path: str):
+    """
+    Yield the current version of every segment in order, reading the index as it goes,
+    so memory stays constant however long the transcript is.
+    """
+    with open(path + ".idx", "rb") as index_file, open(path, "rb") as f:
+        while True:
+            data = index_file.read(INDEX_RECORD.size * 1024)
+            if not data:
+                break
+            for _, _, offset, length in INDEX_RECORD.iter_unpack(data):
+                f.seek(offset)
+                yield json.loads(f.read(length))
+
+
+def compact_transcript(path: str) -> None:
+    """
+    Rewrite a transcript store without the superseded versions of edited segments.
+    """
+    with TranscriptReader(path) as reader, TranscriptWriter(path + ".compact", overwrite=True) as writer:
+        for record in reader:
+            segment_id = writer.count
+            offset, length = writer.write_line(record)
+            writer.index_file.write(INDEX_RECORD.pack(record["start"], record["end"], offset, length))
+            writer.count = segment_id + 1
+
+    os.replace(path + ".compact", path)
+    os.replace(path + ".compact.idx", path + ".idx")
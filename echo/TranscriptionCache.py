@@ -0,0 +1,80 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import numpy as np
+
+from echo.config import get_model_config
+
+
+class TranscriptionCache:
+    def __init__(self, cache_path: str = None, max_size_mb: float = None):
+        """
+        Persistent cache of transcribed segments, keyed by the hash of the decoded audio and the decoding options.
+        Entries are evicted least recently used first once the cache grows over `max_size_mb`.
+        """
+        self.cache_path = cache_path or get_model_config()["cache"]["path"]
+        self.max_size = int((max_size_mb or get_model_config()["cache"]["max_size_mb"]) * 1024 * 1024)
+
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        # Batch workers share the same file, sqlite serialises their writes.
+        self.connection = sqlite3.connect(self.cache_path, timeout=30)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, segments TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def make_key(audio: np.ndarray, **options) -> str:
+        digest = hashlib.sha256(memoryview(np.ascontiguousarray(audio)))
+        digest.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        row = self.connection.execute("SELECT segments FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+
+        self.connection.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+        self.connection.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, segments: list) -> None:
+        data = json.dumps(segments, ensure_ascii=False, default=float)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO entries (key, segments, size, last_access) VALUES (?, ?, ?, ?)",
+            (key, data, len(data.encode("utf-8")), time.time())
+        )
+        self.connection.commit()
+        self.evict()
+
+    def evict(self) -> None:
+        total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total_size <= self.max_size:
+            return
+
+        evicted = []
+        for key, size in self.connection.execute("SELECT key, size FROM entries ORDER BY last_access"):
+            if total_size <= self.max_size:
+                break
+            evicted.append((key,))
+            total_size -= size
+
+        self.connection.executemany("DELETE FROM entries WHERE key = ?", evicted)
+        self.connection.commit()
+
+    def info(self) -> dict:
+        count, size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {
+            "path": self.cache_path,
+            "entries": count,
+            "size_mb": round(size / (1024 * 1024), 2),
+            "max_size_mb": round(self.max_size / (1024 * 1024), 2)
+        }
+
+    def clear(self) -> None:
+        self.connection.execute("DELETE FROM entries")
+        self.connection.commit()
+        self.connection.execute("VACUUM")
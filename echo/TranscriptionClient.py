@@ -0,0 +1,53 @@
+import json
+import time
+
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from echo.config import get_model_config
+
+
+class TranscriptionClient:
+    def __init__(self, host: str = None, port: int = None):
+        """
+        Client of a local TranscriptionServer.
+        """
+        server_config = get_model_config()["server"]
+        self.base_url = f"http://{host or server_config['host']}:{port or server_config['port']}"
+
+    def request(self, path: str, body: dict = None, method: str = None) -> dict:
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        request = Request(self.base_url + path, data=data, headers={"Content-Type": "application/json"},
+                          method=method)
+        try:
+            with urlopen(request) as response:
+                return json.loads(response.read())
+        except HTTPError as e:
+            raise ValueError(f"Transcription server answered {e.code}: {json.loads(e.read()).get('error')}")
+
+    def submit(self, video_path: str, model_name: str, language: str = "Chinese", priority: int = 0,
+               use_vad: bool = False, batch_size: int = 0) -> dict:
+        return self.request("/jobs", {"video_path": video_path, "model_name": model_name, "language": language,
+                                      "priority": priority, "use_vad": use_vad, "batch_size": batch_size})
+
+    def status(self, job_id: str) -> dict:
+        return self.request(f"/jobs/{job_id}")
+
+    def delete(self, job_id: str) -> dict:
+        return self.request(f"/jobs/{job_id}", method="DELETE")
+
+    def iter_segments(self, job_id: str, poll_interval: float = 1.0):
+        """
+        Yield the job's segments as the server produces them, until the job is done.
+        """
+        since = 0
+        while True:
+            response = self.request(f"/jobs/{job_id}/segments?since={since}")
+            yield from response["segments"]
+            since = response["next"]
+
+            if response["status"] == "failed":
+                raise RuntimeError(f"Job {job_id} failed:\n{self.status(job_id)['error']}")
+            if response["status"] == "done":
+                return
+            time.sleep(poll_interval)
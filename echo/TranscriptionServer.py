@@ -0,0 +1,293 @@
+import re
+import json
+import time
+import uuid
+import queue
+import threading
+import traceback
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from echo.CaptionParser import CaptionParser
+from echo.config import get_model_config
+
+
+class ModelPool:
+    def __init__(self, max_models: int):
+        """
+        Transcription models kept loaded in memory, the least recently used one is dropped past `max_models`.
+        Whisper installs its KV cache and word timestamp hooks on the model's modules while decoding,
+        so every model has a lock and only one job at a time uses it.
+        """
+        self.max_models = max_models
+        self.models = OrderedDict()
+        self.lock = threading.Lock()
+        # One lock per model being downloaded or loaded, so other models stay available meanwhile.
+        self.loading = {}
+
+    def get(self, model_name: str) -> tuple:
+        """
+        The (model, lock) of `model_name`, downloaded and loaded on first use.
+        """
+        from model_management.whisper import whisper_download
+
+        with self.lock:
+            if model_name in self.models:
+                self.models.move_to_end(model_name)
+                return self.models[model_name]
+            loading = self.loading.setdefault(model_name, threading.Lock())
+
+        with loading:
+            with self.lock:
+                if model_name in self.models:
+                    self.models.move_to_end(model_name)
+                    return self.models[model_name]
+
+            whisper_download(model_name)
+            print(f"Loading {model_name} into the model pool")
+            model = (CaptionParser.load_whisper_model(model_name), threading.Lock())
+
+            with self.lock:
+                self.models[model_name] = model
+                self.loading.pop(model_name, None)
+            self.trim()
+            return model
+
+    def trim(self) -> None:
+        """
+        Unload the least recently used models past `max_models`. Models a job is using are kept until it is done,
+        otherwise the next job on them would load a second copy, and so is the model just asked for.
+        """
+        with self.lock:
+            for model_name, (_, lock) in list(self.models.items())[:-1]:
+                if len(self.models) <= self.max_models:
+                    break
+                if not lock.locked():
+                    del self.models[model_name]
+                    print(f"Unloaded {model_name} from the model pool")
+
+    @contextmanager
+    def use(self, model_name: str):
+        model, lock = self.get(model_name)
+        try:
+            with lock:
+                yield model
+        finally:
+            self.trim()
+
+    def names(self) -> list:
+        with self.lock:
+            return list(self.models)
+
+
+class TranscriptionServer:
+    def __init__(self, model_names: list = None, host: str = None, port: int = None, workers: int = 1,
+                 max_models: int = None):
+        """
+        Long running transcription service. Models stay warm in a ModelPool, jobs are submitted over a local
+        HTTP API, run by `workers` threads in priority order, and their segments can be polled while they run.
+        Finished jobs are kept for server.job_ttl seconds and at most server.max_finished_jobs of them,
+        or until they are deleted.
+        """
+        server_config = get_model_config()["server"]
+        self.host = host or server_config["host"]
+        self.port = port or server_config["port"]
+        self.workers = workers
+        self.model_pool = ModelPool(max_models or server_config["max_models"])
+        self.job_ttl = server_config["job_ttl"]
+        self.max_finished_jobs = server_config["max_finished_jobs"]
+        self.model_names = model_names or []
+
+        self.jobs = {}
+        self.jobs_lock = threading.Lock()
+        self.job_queue = queue.PriorityQueue()
+        self.job_count = 0
+
+    def submit(self, request: dict) -> dict:
+        from model_management.whisper import whisper_model_address
+
+        assert request.get("video_path"), "video_path is required."
+        assert request.get("model_name") in whisper_model_address, "Only Whisper models are served."
+
+        self.prune_jobs()
+        with self.jobs_lock:
+            self.job_count += 1
+            job = {
+                "id": uuid.uuid4().hex,
+                "video_path": request["video_path"],
+                "model_name": request["model_name"],
+                "language": request.get("language", "Chinese"),
+                "use_vad": bool(request.get("use_vad", False)),
+                "batch_size": int(request.get("batch_size", 0)),
+                # Lower runs first, equal priorities run in submission order.
+                "priority": int(request.get("priority", 0)),
+                "status": "queued",
+                "error": None,
+                "segments": [],
+                "submitted": time.time(),
+                "started": None,
+                "finished": None,
+            }
+            self.jobs[job["id"]] = job
+            self.job_queue.put((job["priority"], self.job_count, job["id"]))
+        return self.describe(job)
+
+    def prune_jobs(self) -> None:
+        with self.jobs_lock:
+            finished = sorted((job for job in self.jobs.values() if job["finished"] is not None),
+                              key=lambda job: job["finished"])
+            expired = [job for job in finished if time.time() - job["finished"] > self.job_ttl]
+            expired += finished[len(expired):max(len(expired), len(finished) - self.max_finished_jobs)]
+            for job in expired:
+                del self.jobs[job["id"]]
+
+    def delete(self, job_id: str) -> dict:
+        """
+        Forget a finished job or cancel a queued one. Running jobs can not be stopped.
+        """
+        with self.jobs_lock:
+            job = self.jobs[job_id]
+            assert job["status"] != "running", f"Job {job_id} is running."
+            del self.jobs[job_id]
+        return self.describe(job)
+
+    @staticmethod
+    def describe(job: dict) -> dict:
+        description = {key: value for key, value in job.items() if key != "segments"}
+        description["segment_count"] = len(job["segments"])
+        return description
+
+    def run_job(self, job: dict, speech_recognition_model) -> None:
+        model_info = {"model_name": job["model_name"], "model_type": "whisper", "model_path": None}
+        # Audio extraction and VAD run before the model is taken, so other jobs on it are not held up.
+        caption_parser = CaptionParser(job["video_path"], language=job["language"], use_vad=job["use_vad"],
+                                       batch_size=job["batch_size"],
+                                       speech_recognition_model=speech_recognition_model, **model_info)
+
+        with self.model_pool.use(job["model_name"]) as transcribe_model:
+            caption_parser.transcribe_model = transcribe_model
+            if caption_parser.batch_size > 0:
+                job["segments"].extend(caption_parser.do_whisper_transcribe_batched())
+            else:
+                # Window by window, so clients see segments while the job is still running.
+                for _, _, segments in caption_parser.iter_whisper_chunks(caption_parser.get_windows()):
+                    job["segments"].extend(segments)
+
+        caption_parser.save_captions(job["segments"])
+
+    def work(self) -> None:
+        from silero_vad import load_silero_vad
+
+        # Silero VAD keeps state between calls, every worker gets its own.
+        speech_recognition_model = load_silero_vad(onnx=False)
+        while True:
+            self.run_next(speech_recognition_model)
+
+    def run_next(self, speech_recognition_model) -> None:
+        """
+        Wait for the next queued job and run it.
+        """
+        _, _, job_id = self.job_queue.get()
+        with self.jobs_lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                # Deleted while it was queued.
+                return
+            job["status"] = "running"
+            job["started"] = time.time()
+        try:
+            self.run_job(job, speech_recognition_model)
+            job["status"] = "done"
+        except Exception:
+            job["status"] = "failed"
+            job["error"] = traceback.format_exc()
+        job["finished"] = time.time()
+        print(f"Job {job_id} {job['status']} ({job['video_path']})")
+        self.prune_jobs()
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def send_json(self, status: int, body) -> None:
+                data = json.dumps(body, ensure_ascii=False, default=float).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def get_job(self, job_id: str):
+                job = server.jobs.get(job_id)
+                if job is None:
+                    self.send_json(404, {"error": f"No job {job_id}"})
+                return job
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == "/models":
+                    return self.send_json(200, {"models": server.model_pool.names()})
+                if url.path == "/jobs":
+                    server.prune_jobs()
+                    return self.send_json(200, {"jobs": [server.describe(job) for job in list(server.jobs.values())]})
+
+                match = re.fullmatch(r"/jobs/(\w+)(/segments)?", url.path)
+                if match is None:
+                    return self.send_json(404, {"error": f"Unknown path {url.path}"})
+                job = self.get_job(match.group(1))
+                if job is None:
+                    return
+                if match.group(2) is None:
+                    return self.send_json(200, server.describe(job))
+
+                # Read the status before the segments, so a finished job always returns all of them.
+                status = job["status"]
+                since = int(parse_qs(url.query).get("since", ["0"])[0])
+                segments = job["segments"][since:]
+                self.send_json(200, {"status": status, "segments": segments, "next": since + len(segments)})
+
+            def do_POST(self):
+                if urlparse(self.path).path != "/jobs":
+                    return self.send_json(404, {"error": f"Unknown path {self.path}"})
+                try:
+                    request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                    self.send_json(201, server.submit(request))
+                except (AssertionError, ValueError) as e:
+                    self.send_json(400, {"error": str(e)})
+
+            def do_DELETE(self):
+                match = re.fullmatch(r"/jobs/(\w+)", urlparse(self.path).path)
+                if match is None:
+                    return self.send_json(404, {"error": f"Unknown path {self.path}"})
+                if self.get_job(match.group(1)) is None:
+                    return
+                try:
+                    self.send_json(200, server.delete(match.group(1)))
+                except KeyError:
+                    self.send_json(404, {"error": f"No job {match.group(1)}"})
+                except AssertionError as e:
+                    self.send_json(409, {"error": str(e)})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def serve_forever(self) -> None:
+        for model_name in self.model_names:
+            self.model_pool.get(model_name)
+
+        for _ in range(self.workers):
+            threading.Thread(target=self.work, daemon=True).start()
+
+        http_server = ThreadingHTTPServer((self.host, self.port), self.make_handler())
+        print(f"Transcription server listening on http://{self.host}:{self.port}")
+        try:
+            http_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            http_server.server_close()
@@ -0,0 +1,23 @@
+import os
+
+from functools import lru_cache
+
+# Configs are read from the repository's conf directory whatever the working directory is,
+# and only when first needed.
+CONF_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "conf")
+
+
+@lru_cache(maxsize=None)
+def load_config(name: str) -> dict:
+    import yaml
+
+    with open(os.path.join(CONF_DIR, name + ".yaml"), "r", encoding="utf-8") as f:
+        return yaml.load(f, Loader=yaml.FullLoader)
+
+
+def get_model_config() -> dict:
+    return load_config("model_config")
+
+
+def get_caption_config() -> dict:
+    return load_config("caption_config")
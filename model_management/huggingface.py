@@ -1,27 +1,28 @@
 import argparse
 import os
-import yaml
 import warnings
 
 from huggingface_hub import snapshot_download, hf_hub_download
 
-model_config = yaml.load(
-    open("./conf/model_config.yaml"
-         if not __name__ == "__main__" else
-         "../conf/model_config.yaml", "r"),
-    Loader=yaml.FullLoader
-)
+from model_management.manifest import is_file_verified, record_file, is_snapshot_verified, record_snapshot
+from echo.config import get_model_config
 
 
 def huggingface_download_file(repo: str, filename: str, args: argparse.Namespace, retry: bool = False) -> None:
+    local_path = os.path.join(get_model_config()["default_model_path"], "huggingface", repo, filename)
+    if not args.force_download and is_file_verified(f"huggingface/{repo}/{filename}", local_path):
+        print(f"{filename} from {repo} already exists and is unchanged since it was verified.")
+        return
+
     try:
         hf_hub_download(
             repo_id=repo,
             filename=filename,
             force_download=args.force_download,
             use_auth_token=args.token,
-            local_dir=os.path.join(model_config["default_model_path"], "huggingface", repo)
+            local_dir=os.path.join(get_model_config()["default_model_path"], "huggingface", repo)
         )
+        record_file(f"huggingface/{repo}/{filename}", local_path)
         print(f"Downloaded {filename} from {repo}")
     except Exception as e:
         if retry:
@@ -31,14 +32,20 @@ def huggingface_download_file(repo: str, filename: str, args: argparse.Namespace
 
 
 def huggingface_download_repo(repo: str, args: argparse.Namespace, retry: bool = False) -> None:
+    local_path = os.path.join(get_model_config()["default_model_path"], "huggingface", repo)
+    if not args.force_download and is_snapshot_verified(f"huggingface/{repo}", local_path):
+        print(f"{repo} already exists and is unchanged since it was verified.")
+        return
+
     try:
         snapshot_download(
             repo_id=repo,
             revision="main",
             use_auth_token=args.token,
             force_download=args.force_download,
-            local_dir=os.path.join(model_config["default_model_path"], "huggingface", repo)
+            local_dir=os.path.join(get_model_config()["default_model_path"], "huggingface", repo)
         )
+        record_snapshot(f"huggingface/{repo}", local_path)
         print(f"Downloaded {repo}")
     except Exception as e:
         if retry:
@@ -48,8 +55,8 @@ def huggingface_download_repo(repo: str, args: argparse.Namespace, retry: bool =
 
 
 def huggingface_download(model_name: str, args: argparse.Namespace) -> None:
-    os.makedirs(os.path.join(model_config["default_model_path"], "huggingface"), exist_ok=True)
-    os.makedirs(os.path.join(model_config["default_model_path"], "huggingface", model_name), exist_ok=True)
+    os.makedirs(os.path.join(get_model_config()["default_model_path"], "huggingface"), exist_ok=True)
+    os.makedirs(os.path.join(get_model_config()["default_model_path"], "huggingface", model_name), exist_ok=True)
 
     if args.filename:
         huggingface_download_file(model_name, args.filename, args)
@@ -0,0 +1,132 @@
+import os
+import json
+import hashlib
+
+from echo.config import get_model_config
+
+# Records the size, mtime and inode of every verified model file next to its SHA256,
+# so files that have not changed since they were verified are trusted without hashing them again.
+
+
+def get_manifest_path() -> str:
+    return os.path.join(get_model_config()["default_model_path"], "manifest.json")
+
+
+def load_manifest() -> dict:
+    if not os.path.exists(get_manifest_path()):
+        return {}
+    with open(get_manifest_path(), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: dict) -> None:
+    os.makedirs(get_model_config()["default_model_path"], exist_ok=True)
+    temp_path = get_manifest_path() + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(temp_path, get_manifest_path())
+
+
+def sha256_file(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_fingerprint(file_path: str) -> dict:
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino}
+
+
+def list_snapshot_files(snapshot_path: str) -> list:
+    files = []
+    for root, dirs, filenames in os.walk(snapshot_path):
+        # huggingface_hub keeps its download metadata in .cache, it is not part of the model.
+        dirs[:] = [directory for directory in dirs if directory != ".cache"]
+        files.extend(os.path.relpath(os.path.join(root, filename), snapshot_path) for filename in filenames)
+    return sorted(files)
+
+
+def is_file_verified(key: str, file_path: str, sha256: str = None) -> bool:
+    """
+    True when `file_path` is unchanged since it was recorded under `key`, and its recorded SHA256 is `sha256`.
+    """
+    entry = load_manifest().get(key)
+    if entry is None or not os.path.exists(file_path):
+        return False
+    if sha256 is not None and entry["sha256"] != sha256:
+        return False
+    return entry["fingerprint"] == get_fingerprint(file_path)
+
+
+def record_file(key: str, file_path: str, sha256: str = None) -> None:
+    manifest = load_manifest()
+    manifest[key] = {
+        "type": "file",
+        "path": file_path,
+        "sha256": sha256 or sha256_file(file_path),
+        "fingerprint": get_fingerprint(file_path)
+    }
+    save_manifest(manifest)
+
+
+def is_snapshot_verified(key: str, snapshot_path: str) -> bool:
+    """
+    True when the snapshot directory holds exactly the recorded files, none of them changed.
+    """
+    entry = load_manifest().get(key)
+    if entry is None or not os.path.isdir(snapshot_path):
+        return False
+
+    files = list_snapshot_files(snapshot_path)
+    if files != sorted(entry["files"]):
+        return False
+    return all(entry["files"][file]["fingerprint"] == get_fingerprint(os.path.join(snapshot_path, file))
+               for file in files)
+
+
+def record_snapshot(key: str, snapshot_path: str) -> None:
+    manifest = load_manifest()
+    manifest[key] = {
+        "type": "snapshot",
+        "path": snapshot_path,
+        "files": {
+            file: {
+                "sha256": sha256_file(os.path.join(snapshot_path, file)),
+                "fingerprint": get_fingerprint(os.path.join(snapshot_path, file))
+            }
+            for file in list_snapshot_files(snapshot_path)
+        }
+    }
+    save_manifest(manifest)
+
+
+def verify_models() -> list:
+    """
+    Hash every model in the manifest again. Entries whose files are missing or changed are dropped,
+    so the next run downloads or checks them again. Returns the keys that failed.
+    """
+    manifest = load_manifest()
+    failed = []
+    for key, entry in list(manifest.items()):
+        if entry["type"] == "file":
+            files = {entry["path"]: entry}
+        else:
+            files = {os.path.join(entry["path"], file): file_entry for file, file_entry in entry["files"].items()}
+            if list_snapshot_files(entry["path"]) != sorted(entry["files"]):
+                files = None
+
+        if files is not None and all(os.path.exists(path) and sha256_file(path) == file_entry["sha256"]
+                                     for path, file_entry in files.items()):
+            for path, file_entry in files.items():
+                file_entry["fingerprint"] = get_fingerprint(path)
+            print(f"{key}: OK")
+        else:
+            print(f"{key}: FAILED, removed from the manifest")
+            del manifest[key]
+            failed.append(key)
+
+    save_manifest(manifest)
+    return failed
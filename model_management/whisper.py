@@ -1,9 +1,17 @@
 import os
+import json
 import requests
 from tqdm import tqdm
 import warnings
 import hashlib
-import yaml
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from model_management.manifest import is_file_verified, record_file, sha256_file
+from echo.config import get_model_config
 
 whisper_model_address = {
     "tiny.en": "https://openaipublic.azureedge.net/main/whisper/models/d3dd57d32accea0b295c96e26691aa14d8822fac7d9d27d5dc00b4ca2826dd03/tiny.en.pt",
@@ -22,63 +30,203 @@ whisper_model_address = {
     "turbo": "https://openaipublic.azureedge.net/main/whisper/models/aff26ae408abcba5fbf8813c21e62b0941638c5f6eebfb145be0c9839262a19a/large-v3-turbo.pt",
 }
 
-model_config = yaml.load(
-    open("./conf/model_config.yaml"
-         if not __name__ == "__main__" else
-         "../conf/model_config.yaml", "r"),
-    Loader=yaml.FullLoader
-)
 
-def download_model_from_url(model_name: str, url: str, local_download_model_path: str, retry: bool = False) -> None:
-    response = requests.get(url, stream=True)
+class RangeNotSupportedError(Exception):
+    pass
+
+
+class OrderedHasher:
+    def __init__(self, max_pending: int):
+        """
+        SHA256 of a file downloaded in parts that finish out of order. Parts are hashed as soon as
+        all parts before them arrived, at most `max_pending` parts are held in memory or in flight.
+        """
+        self.sha256 = hashlib.sha256()
+        self.next_index = 0
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_pending)
+
+    def update(self, index: int, data: bytes) -> None:
+        with self.lock:
+            self.pending[index] = data
+            while self.next_index in self.pending:
+                self.sha256.update(self.pending.pop(self.next_index))
+                self.next_index += 1
+                self.slots.release()
+
+    def hexdigest(self) -> str:
+        return self.sha256.hexdigest()
+
+
+def create_session(workers: int) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers,
+                          max_retries=Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504]))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def download_part(session: requests.Session, url: str, start: int, end: int, pbar: tqdm) -> bytes:
+    for attempt in range(3):
+        try:
+            response = session.get(url, headers={"Range": f"bytes={start}-{end}"}, stream=True, timeout=60)
+            if response.status_code == 200:
+                # The server advertised ranges but sends the whole file, retrying the part will not help.
+                response.close()
+                raise RangeNotSupportedError(f"{url} answered a range request with the whole file")
+            if response.status_code != 206:
+                raise ValueError(f"Range request answered with status code {response.status_code}")
+
+            data = bytearray()
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                data += chunk
+                pbar.update(len(chunk))
+            if len(data) != end - start + 1:
+                raise ValueError(f"Received {len(data)} bytes instead of {end - start + 1}")
+            return bytes(data)
+        except RangeNotSupportedError:
+            raise
+        except Exception as e:
+            if attempt == 2:
+                raise
+            warnings.warn(f"Failed to download bytes {start}-{end} with error {e}. Retrying.")
+
+
+def download_model_from_url_single(model_name: str, session: requests.Session, url: str,
+                                   local_download_model_path: str) -> str:
+    response = session.get(url, stream=True, timeout=60)
 
     if response.status_code != 200:
         raise ValueError(f"Failed to download model {model_name} from {url} \n with status code {response.status_code}")
 
-    total_size_in_bytes = int(response.headers.get('content-length', 0))
-    total_size_in_mb = total_size_in_bytes / (1024 * 1024)
+    sha256 = hashlib.sha256()
+    with open(local_download_model_path, "wb") as handle, \
+            tqdm(total=int(response.headers.get("content-length", 0)), unit="B", unit_scale=True,
+                 unit_divisor=1024, desc="Downloading") as pbar:
+        for data in response.iter_content(chunk_size=1024 * 1024):
+            handle.write(data)
+            sha256.update(data)
+            pbar.update(len(data))
+
+    return sha256.hexdigest()
+
+
+def download_model_from_url(model_name: str, url: str, local_download_model_path: str, retry: bool = False) -> str:
+    """
+    Download `url` in parallel HTTP ranges to `local_download_model_path` and return its SHA256.
+    Data is hashed while it arrives. Parts go to a .part file and finished parts are listed in a .part.json file,
+    so an interrupted download resumes where it stopped. Servers without range support are read in one stream.
+    """
+    workers = get_model_config()["download"]["workers"]
+    part_size = int(get_model_config()["download"]["part_size_mb"] * 1024 * 1024)
+    session = create_session(workers)
+
+    head = session.head(url, allow_redirects=True, timeout=60)
+    total_size = int(head.headers.get("content-length", 0))
+    if head.status_code != 200 or head.headers.get("accept-ranges") != "bytes" or total_size == 0:
+        return download_model_from_url_single(model_name, session, url, local_download_model_path)
+
+    part_path = local_download_model_path + ".part"
+    state_path = part_path + ".json"
+    state = {"url": url, "size": total_size, "part_size": part_size, "completed": []}
+    if os.path.exists(part_path) and os.path.exists(state_path):
+        with open(state_path, "r") as f:
+            saved_state = json.load(f)
+        if all(saved_state[key] == state[key] for key in ["url", "size", "part_size"]):
+            state = saved_state
+            print(f"Resuming download of {model_name}, {len(state['completed'])} parts already downloaded")
+
+    completed = set(state["completed"])
+    parts = [(start, min(start + part_size, total_size) - 1) for start in range(0, total_size, part_size)]
+    hasher = OrderedHasher(2 * workers)
+    file_lock = threading.Lock()
+
+    if not completed or not os.path.exists(part_path):
+        completed = set()
+        with open(part_path, "wb") as handle:
+            handle.truncate(total_size)
+
+    def fetch(index: int, handle, pbar: tqdm) -> None:
+        start, end = parts[index]
+        if index in completed:
+            # Finished before the interruption, only hashed again.
+            with file_lock:
+                handle.seek(start)
+                data = handle.read(end - start + 1)
+            pbar.update(len(data))
+        else:
+            data = download_part(session, url, start, end, pbar)
+            with file_lock:
+                handle.seek(start)
+                handle.write(data)
+                # The part is only recorded as finished once its bytes are on disk.
+                handle.flush()
+                os.fsync(handle.fileno())
+                completed.add(index)
+                state["completed"] = sorted(completed)
+                with open(state_path, "w") as f:
+                    json.dump(state, f)
+        hasher.update(index, data)
 
     try:
-        with open(local_download_model_path, "wb") as handle:
-            with tqdm(total=total_size_in_mb, unit='MB', desc="Downloading",
-                      unit_scale=False, unit_divisor=1024,
-                      mininterval=0.1,
-                      miniters=None,
-                      bar_format='{desc}: {percentage:3.0f}%|{bar}| {n:.2f}MB/{total:.2f}MB [{elapsed}<{remaining}, {rate_fmt}]') as pbar:
-                downloaded_size = 0
-                for data in response.iter_content(chunk_size=4096):
-                    if data:
-                        handle.write(data)
-                        chunk_size_mb = len(data) / (1024 * 1024)
-                        downloaded_size += chunk_size_mb
-                        remaining = max(0, min(chunk_size_mb, total_size_in_mb - pbar.n))
-                        pbar.update(remaining)
-                pbar.close()
+        with open(part_path, "r+b") as handle, \
+                tqdm(total=total_size, unit="B", unit_scale=True, unit_divisor=1024, desc="Downloading") as pbar, \
+                ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for index in range(len(parts)):
+                # Submitted in order, so the part the hasher waits for is always in flight.
+                while not hasher.slots.acquire(timeout=1):
+                    failed = [future for future in futures if future.done() and future.exception()]
+                    if failed:
+                        raise failed[0].exception()
+                futures.append(executor.submit(fetch, index, handle, pbar))
+            for future in futures:
+                future.result()
+    except RangeNotSupportedError as e:
+        warnings.warn(f"{e}. Downloading {model_name} in a single stream.")
+        remove_partial_download(local_download_model_path)
+        return download_model_from_url_single(model_name, session, url, local_download_model_path)
     except Exception as e:
         if retry:
             raise ValueError(f"Failed to download model {model_name} from {url} with error {e}")
 
-        warnings.warn(f"Failed to download model {model_name} from {url} with error {e}."
-                      f"Retrying download.")
-        os.remove(local_download_model_path)
-        download_model_from_url(model_name, url, local_download_model_path, retry=True)
+        warnings.warn(f"Failed to download model {model_name} from {url} with error {e}. "
+                      f"Resuming download.")
+        return download_model_from_url(model_name, url, local_download_model_path, retry=True)
+
+    os.replace(part_path, local_download_model_path)
+    os.remove(state_path)
+    return hasher.hexdigest()
+
+
+def remove_partial_download(local_download_model_path: str) -> None:
+    for path in [local_download_model_path + ".part", local_download_model_path + ".part.json"]:
+        if os.path.exists(path):
+            os.remove(path)
 
 
 def check_sha256(sha256: str, file_path: str):
-    return hashlib.sha256(open(file_path, "rb").read()).hexdigest() == sha256
+    return sha256_file(file_path) == sha256
 
 
 def whisper_download(model_name: str, force_download: bool = False, retry: bool = False) -> None:
-    os.makedirs(os.path.join(model_config["default_model_path"], "whisper"), exist_ok=True)
-    local_download_model_path = os.path.join(model_config["default_model_path"], "whisper", model_name + ".pt")
+    os.makedirs(os.path.join(get_model_config()["default_model_path"], "whisper"), exist_ok=True)
+    local_download_model_path = os.path.join(get_model_config()["default_model_path"], "whisper", model_name + ".pt")
     url = whisper_model_address[model_name]
 
     if os.path.exists(local_download_model_path):
         if force_download:
             print(f"Model detected, but force downloading model {model_name} to {local_download_model_path}")
             os.remove(local_download_model_path)
+            remove_partial_download(local_download_model_path)
         else:
-            if check_sha256(url.split("/")[-2], local_download_model_path):
+            if is_file_verified(f"whisper/{model_name}", local_download_model_path, url.split("/")[-2]):
+                print(f"Model {model_name} already exists and is unchanged since it was verified.")
+                return
+            elif check_sha256(url.split("/")[-2], local_download_model_path):
+                record_file(f"whisper/{model_name}", local_download_model_path, url.split("/")[-2])
                 print(f"Model {model_name} already exists.")
                 return
             else:
@@ -88,9 +236,9 @@ def whisper_download(model_name: str, force_download: bool = False, retry: bool
     else:
         print(f"No model named {model_name}. Downloading to {local_download_model_path}")
 
-    download_model_from_url(model_name, url, local_download_model_path)
+    sha256 = download_model_from_url(model_name, url, local_download_model_path)
 
-    if not check_sha256(url.split("/")[-2], local_download_model_path):
+    if sha256 != url.split("/")[-2]:
         if retry:
             raise ValueError(f"Downloaded model {model_name} SHA256 checksum still does not match the expected value. "
                              f"Exiting.")
@@ -99,7 +247,9 @@ def whisper_download(model_name: str, force_download: bool = False, retry: bool
                       f"Retrying download.")
         os.remove(local_download_model_path)
         whisper_download(model_name, force_download=True, retry=True)
+        return
 
+    record_file(f"whisper/{model_name}", local_download_model_path, sha256)
     print(f"Model {model_name} successfully downloaded to {local_download_model_path}")
 
 
@@ -0,0 +1,49 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+from echo.AudioStream import AudioStream, SAMPLE_RATE
+
+FAKE_FFMPEG = """#!{python}
+import sys
+
+# Far more log output than a pipe buffer holds, written before any samples.
+for i in range({log_lines}):
+    sys.stderr.write("decode error %d\\n" % i)
+sys.stderr.flush()
+sys.stdout.buffer.write(b"\\x00\\x40" * {samples})
+sys.exit({returncode})
+"""
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    def install(samples: int, log_lines: int = 20000, returncode: int = 0) -> None:
+        path = tmp_path / "ffmpeg"
+        path.write_text(FAKE_FFMPEG.format(python=sys.executable, log_lines=log_lines, samples=samples,
+                                           returncode=returncode))
+        path.chmod(0o755)
+        monkeypatch.setenv("PATH", str(tmp_path) + os.pathsep + os.environ["PATH"])
+
+    return install
+
+
+def test_blocks_stream_while_stderr_is_drained(fake_ffmpeg):
+    fake_ffmpeg(samples=SAMPLE_RATE * 5 // 2)
+
+    blocks = list(AudioStream("input.mp4", block_seconds=1.0))
+
+    assert [len(block) for block in blocks] == [SAMPLE_RATE, SAMPLE_RATE, SAMPLE_RATE // 2]
+    assert np.allclose(np.concatenate(blocks), 0.5)
+
+
+def test_failure_reports_the_end_of_stderr(fake_ffmpeg):
+    fake_ffmpeg(samples=SAMPLE_RATE, returncode=1)
+
+    with pytest.raises(RuntimeError) as error:
+        list(AudioStream("input.mp4", block_seconds=1.0))
+
+    assert "decode error 19999" in str(error.value)
+    assert "decode error 0\n" not in str(error.value)
@@ -0,0 +1,120 @@
+import os
+import re
+import json
+import hashlib
+import threading
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from echo.config import get_model_config
+from model_management import whisper
+
+PART_SIZE = 1024
+DATA = os.urandom(10 * PART_SIZE + 100)
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    # Set per test through the server fixture.
+    ignore_range = False
+    ranges = []
+
+    def send_headers(self, status: int, length: int) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.send_headers(200, len(DATA))
+
+    def do_GET(self):
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        if match is None or self.ignore_range:
+            self.send_headers(200, len(DATA))
+            self.wfile.write(DATA)
+            return
+
+        start, end = int(match.group(1)), int(match.group(2))
+        self.ranges.append((start, end))
+        self.send_headers(206, end - start + 1)
+        self.wfile.write(DATA[start:end + 1])
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    config = dict(get_model_config(), download={"workers": 4, "part_size_mb": PART_SIZE / (1024 * 1024)})
+    monkeypatch.setattr(whisper, "get_model_config", lambda: config)
+    monkeypatch.setattr(RangeHandler, "ranges", [])
+
+    http_server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    yield http_server
+    http_server.shutdown()
+    http_server.server_close()
+
+
+def get_url(http_server) -> str:
+    return f"http://127.0.0.1:{http_server.server_address[1]}/model.pt"
+
+
+def test_ranged_download(server, tmp_path):
+    path = str(tmp_path / "model.pt")
+
+    sha256 = whisper.download_model_from_url("test", get_url(server), path)
+
+    assert sha256 == hashlib.sha256(DATA).hexdigest()
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert len(RangeHandler.ranges) == 11
+    assert not os.path.exists(path + ".part") and not os.path.exists(path + ".part.json")
+
+
+def test_download_resumes_missing_parts(server, tmp_path):
+    path = str(tmp_path / "model.pt")
+    completed = [0, 1, 2, 5]
+    with open(path + ".part", "wb") as f:
+        f.truncate(len(DATA))
+        for index in completed:
+            f.seek(index * PART_SIZE)
+            f.write(DATA[index * PART_SIZE:(index + 1) * PART_SIZE])
+    with open(path + ".part.json", "w") as f:
+        json.dump({"url": get_url(server), "size": len(DATA), "part_size": PART_SIZE, "completed": completed}, f)
+
+    sha256 = whisper.download_model_from_url("test", get_url(server), path)
+
+    assert sha256 == hashlib.sha256(DATA).hexdigest()
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert sorted(start // PART_SIZE for start, _ in RangeHandler.ranges) == [3, 4, 6, 7, 8, 9, 10]
+
+
+def test_download_restarts_when_the_file_changed(server, tmp_path):
+    path = str(tmp_path / "model.pt")
+    with open(path + ".part", "wb") as f:
+        f.write(b"\0" * 100)
+    with open(path + ".part.json", "w") as f:
+        json.dump({"url": get_url(server), "size": 100, "part_size": PART_SIZE, "completed": [0]}, f)
+
+    sha256 = whisper.download_model_from_url("test", get_url(server), path)
+
+    assert sha256 == hashlib.sha256(DATA).hexdigest()
+    assert len(RangeHandler.ranges) == 11
+
+
+def test_server_ignoring_ranges_falls_back_to_one_stream(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(RangeHandler, "ignore_range", True)
+    path = str(tmp_path / "model.pt")
+
+    with pytest.warns(UserWarning, match="single stream"):
+        sha256 = whisper.download_model_from_url("test", get_url(server), path)
+
+    assert sha256 == hashlib.sha256(DATA).hexdigest()
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert not os.path.exists(path + ".part") and not os.path.exists(path + ".part.json")
@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import pytest
+
+# ShardedParser imports CaptionParser, which needs torch.
+pytest.importorskip("torch")
+
+from echo.ShardedParser import ShardedParser
+
+
+def make_sharded_parser(shards: int) -> ShardedParser:
+    # A CPU backend always shards across processes, whatever devices the machine has.
+    return ShardedParser(SimpleNamespace(model_type="whisper", backend="int8"), shards)
+
+
+def get_load(shard: list) -> float:
+    return sum(end - start for start, end in shard)
+
+
+def test_assign_balances_audio_across_shards():
+    windows = [(0.0, 30.0), (30.0, 35.0), (40.0, 70.0), (75.0, 85.0), (90.0, 110.0), (110.0, 115.0),
+               (120.0, 130.0)]
+
+    shards = make_sharded_parser(3).assign(windows)
+
+    assert len(shards) == 3
+    assert sorted(window for shard in shards for window in shard) == windows
+    assert all(shard == sorted(shard) for shard in shards)
+    assert sorted(get_load(shard) for shard in shards) == [35.0, 35.0, 40.0]
+
+
+def test_assign_leaves_shards_empty_without_enough_windows():
+    shards = make_sharded_parser(4).assign([(0.0, 10.0), (10.0, 12.0)])
+
+    assert shards == [[(0.0, 10.0)], [(10.0, 12.0)], [], []]
+
+
+def test_merge_segments_orders_and_deduplicates():
+    segments = [
+        {"start": 28.0, "end": 31.0, "text": " across the boundary"},
+        {"start": 0.0, "end": 2.0, "text": "first"},
+        {"start": 29.0, "end": 31.5, "text": "across the boundary "},
+        {"start": 2.0, "end": 29.5, "text": "second"},
+        {"start": 31.0, "end": 33.0, "text": "after"},
+    ]
+
+    merged = ShardedParser.merge_segments(segments)
+
+    assert [(segment["start"], segment["end"], segment["text"].strip()) for segment in merged] == [
+        (0.0, 2.0, "first"),
+        (2.0, 28.0, "second"),
+        (28.0, 31.0, "across the boundary"),
+        (31.0, 33.0, "after"),
+    ]
@@ -0,0 +1,145 @@
+import threading
+
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+# The server module imports CaptionParser, which needs torch.
+pytest.importorskip("torch")
+
+from echo.TranscriptionClient import TranscriptionClient
+from echo.TranscriptionServer import TranscriptionServer
+
+
+@pytest.fixture
+def service():
+    server = TranscriptionServer()
+    http_server = ThreadingHTTPServer(("127.0.0.1", 0), server.make_handler())
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    yield server, TranscriptionClient("127.0.0.1", http_server.server_address[1])
+    http_server.shutdown()
+    http_server.server_close()
+
+
+def segment(text: str) -> dict:
+    return {"start": 0.0, "end": 1.0, "text": text}
+
+
+def test_jobs_run_in_priority_order(service):
+    server, client = service
+    order = []
+    server.run_job = lambda job, speech_recognition_model: order.append(job["video_path"])
+
+    jobs = [client.submit("a.mp4", "tiny", priority=1), client.submit("b.mp4", "tiny"),
+            client.submit("c.mp4", "tiny", priority=1)]
+    assert [client.status(job["id"])["status"] for job in jobs] == ["queued"] * 3
+
+    for _ in jobs:
+        server.run_next(None)
+
+    assert order == ["b.mp4", "a.mp4", "c.mp4"]
+    assert [client.status(job["id"])["status"] for job in jobs] == ["done"] * 3
+
+
+def test_segments_are_polled_while_the_job_runs(service):
+    server, client = service
+    started = threading.Event()
+    release = threading.Event()
+
+    def run_job(job, speech_recognition_model):
+        job["segments"].append(segment("first"))
+        started.set()
+        release.wait(10)
+        job["segments"].append(segment("second"))
+
+    server.run_job = run_job
+    job = client.submit("a.mp4", "tiny")
+    thread = threading.Thread(target=server.run_next, args=(None,))
+    thread.start()
+    started.wait(10)
+
+    assert client.request(f"/jobs/{job['id']}/segments") == {"status": "running", "segments": [segment("first")],
+                                                              "next": 1}
+    assert client.request(f"/jobs/{job['id']}/segments?since=1")["segments"] == []
+
+    release.set()
+    thread.join()
+    assert list(client.iter_segments(job["id"], poll_interval=0)) == [segment("first"), segment("second")]
+    assert client.status(job["id"])["segment_count"] == 2
+
+
+def test_failed_job_reports_its_error(service):
+    server, client = service
+
+    def run_job(job, speech_recognition_model):
+        raise ValueError("unreadable video")
+
+    server.run_job = run_job
+    job = client.submit("a.mp4", "tiny")
+    server.run_next(None)
+
+    assert client.status(job["id"])["status"] == "failed"
+    with pytest.raises(RuntimeError, match="unreadable video"):
+        list(client.iter_segments(job["id"], poll_interval=0))
+
+
+def test_invalid_jobs_are_rejected(service):
+    _, client = service
+
+    with pytest.raises(ValueError, match="400"):
+        client.submit("a.mp4", "not-a-model")
+    with pytest.raises(ValueError, match="404"):
+        client.status("0123abcd")
+
+
+def test_delete_jobs(service):
+    server, client = service
+    started = threading.Event()
+    release = threading.Event()
+    ran = []
+
+    def run_job(job, speech_recognition_model):
+        ran.append(job["video_path"])
+        started.set()
+        release.wait(10)
+
+    server.run_job = run_job
+    running = client.submit("a.mp4", "tiny")
+    queued = client.submit("b.mp4", "tiny")
+    thread = threading.Thread(target=server.run_next, args=(None,))
+    thread.start()
+    started.wait(10)
+
+    with pytest.raises(ValueError, match="409"):
+        client.delete(running["id"])
+    assert client.delete(queued["id"])["status"] == "queued"
+
+    release.set()
+    thread.join()
+    assert client.delete(running["id"])["status"] == "done"
+    with pytest.raises(ValueError, match="404"):
+        client.status(running["id"])
+
+    # The deleted job is skipped when it comes up in the queue.
+    server.run_next(None)
+    assert ran == ["a.mp4"]
+
+
+def test_finished_jobs_are_pruned(service):
+    server, client = service
+    server.run_job = lambda job, speech_recognition_model: None
+    server.max_finished_jobs = 1
+
+    first = client.submit("a.mp4", "tiny")
+    second = client.submit("b.mp4", "tiny")
+    server.run_next(None)
+    server.run_next(None)
+    queued = client.submit("c.mp4", "tiny")
+
+    assert [job["id"] for job in client.request("/jobs")["jobs"]] == [second["id"], queued["id"]]
+    with pytest.raises(ValueError, match="404"):
+        client.status(first["id"])
+
+    server.job_ttl = -1
+    assert [job["id"] for job in client.request("/jobs")["jobs"]] == [queued["id"]]
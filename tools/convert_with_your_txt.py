@@ -1,6 +1,13 @@
 import os
+import sys
 import argparse
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from echo.CaptionSegmenter import CaptionSegmenter
+from echo.TranscriptStore import TranscriptReader, TranscriptWriter
+from echo.config import get_caption_config
+
 
 def do_replacement(checked_txt, tgt_txt):
     '''
@@ -29,18 +36,18 @@ def do_replacement(checked_txt, tgt_txt):
     -> 7.92-11.74: The words before check, some words
     '''
     with open(checked_txt, 'r') as f:
-        checked_txt = f.read()
+        checked_content = f.read()
     with open(tgt_txt, 'r') as f:
-        tgt_txt = f.read()
+        tgt_content = f.read()
 
-    checked_lines = checked_txt.split('\n')
-    tgt_lines = tgt_txt.split('\n')
+    checked_lines = checked_content.split('\n')
+    tgt_lines = tgt_content.split('\n')
 
     assert len(checked_lines) == len(tgt_lines), \
         'The count of the lines in checked_txt must equal to the count of the lines in tgt_txt.'
 
     with open(tgt_txt.replace('.txt', '_old.txt'), 'w') as f:
-        f.write(tgt_txt)
+        f.write(tgt_content)
 
     with open(tgt_txt, 'w') as f:
         for i in range(len(checked_lines)):
@@ -50,12 +57,85 @@ def do_replacement(checked_txt, tgt_txt):
                 f.write(tgt_lines[i] + '\n')
 
 
+def do_transcript_replacement(checked_txt, transcript):
+    '''
+    This function replaces the text of the segments in the transcript store with the lines in checked_txt,
+    line i being the text of segment i. Only the segments whose text changed are written,
+    they are appended to the store, so the transcript is never parsed or rewritten as a whole.
+
+    Returns the ids of the changed segments.
+    '''
+    with open(checked_txt, 'r', encoding='utf-8') as f:
+        checked_lines = f.read().rstrip('\n').split('\n')
+
+    changed = []
+    with TranscriptReader(transcript) as reader, TranscriptWriter(transcript) as writer:
+        assert len(checked_lines) == len(reader), \
+            'The count of the lines in checked_txt must equal to the count of the segments in the transcript.'
+
+        for i, line in enumerate(checked_lines):
+            if line.strip() != reader[i]['text']:
+                writer.update(i, text=line.strip())
+                changed.append(i)
+
+    return changed
+
+
+def find_segment(reader, ids):
+    '''
+    This function returns the first of the segment ids that has text, or None.
+    '''
+    return next((i for i in ids if reader[i]['text'].strip()), None)
+
+
+def update_captions(transcript, changed):
+    '''
+    This function re-chunks only the corrected segments into captions, together with the segment before each,
+    whose last caption is clipped against the start of the corrected one, and stores them in the transcript,
+    where write and export pick them up instead of re-chunking.
+    The captions of a segment depend on nothing but the segment and the start of the next one,
+    so the rest of the timeline stays as it is.
+
+    Returns a dict from segment id to its (start, end, text) captions, in segment order.
+    '''
+    segmenter = CaptionSegmenter(get_caption_config())
+    captions = {}
+    with TranscriptReader(transcript) as reader:
+        affected = set()
+        for i in changed:
+            affected.add(i)
+            previous = find_segment(reader, range(i - 1, -1, -1))
+            if previous is not None:
+                affected.add(previous)
+
+        for i in sorted(affected):
+            if not reader[i]['text'].strip():
+                continue
+            next_id = find_segment(reader, range(i + 1, len(reader)))
+            captions[i] = segmenter.segment_captions(reader[i], reader[next_id] if next_id is not None else None)
+
+    with TranscriptWriter(transcript) as writer:
+        for i, segment_captions in captions.items():
+            writer.update(i, captions=segment_captions, captions_key=segmenter.key)
+    return captions
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-checked_txt", type=str, required=True)
-    parser.add_argument("-tgt_txt", type=str, required=True)
+    parser.add_argument("-tgt_txt", type=str, help="Caption txt file in ./output_txt to rewrite.")
+    parser.add_argument("-transcript", type=str, help="Transcript store in ./output_transcript to correct.")
     args = parser.parse_args()
-    do_replacement(args.checked_txt, args.tgt_txt)
+    assert args.tgt_txt or args.transcript, 'Either -tgt_txt or -transcript is required.'
+
+    if args.transcript:
+        changed = do_transcript_replacement(args.checked_txt, args.transcript)
+        print(f'Corrected {len(changed)} segments of {args.transcript}')
+        for i, captions in update_captions(args.transcript, changed).items():
+            for start, end, text in captions:
+                print(f'{i}: {start}-{end}: ' + text.replace('\n', ' / '))
+    if args.tgt_txt:
+        do_replacement(args.checked_txt, args.tgt_txt)
 
 
 if __name__ == '__main__':